@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+import json
+import logging
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+DeliveryLogRecord = Tuple[UUID, UUID, str, Optional[str], datetime.datetime, Optional[str]]
+
+
+class DeliveryLogger:
+    """
+    Write-behind audit trail of note events. Endpoints call `record`, which only
+    appends to an in-memory buffer; a background task writes the buffer to
+    delivery_logs with COPY when `batch_size` events are waiting or every
+    `flush_interval` seconds. When `max_buffered` events are already waiting
+    (the database is slow or down), new events are dropped and counted instead
+    of slowing requests down or growing memory without bound.
+    """
+
+    def __init__(self, db: Database, max_buffered: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0):
+        self.db = db
+        self.max_buffered = max_buffered
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: List[DeliveryLogRecord] = []
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+        self.recorded_total = 0
+        self.written_total = 0
+        self.dropped_total = 0
+        self.errors_total = 0
+        self.last_flush_seconds = 0.0
+
+    def record(self, event_type: str, note_id: UUID, vault_id: UUID, client: Optional[str] = None, **details):
+        if len(self.buffer) >= self.max_buffered:
+            self.dropped_total += 1
+            return
+        self.buffer.append((
+            note_id, vault_id, event_type, client,
+            datetime.datetime.now(datetime.timezone.utc),
+            json.dumps(details) if details else None,
+        ))
+        self.recorded_total += 1
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background task and write out whatever is still buffered.
+        """
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.buffer:
+            if not await self.flush():
+                break
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            while self.buffer:
+                if not await self.flush() or len(self.buffer) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        """
+        Write up to `batch_size` buffered events. A failed batch is dropped, so a
+        broken database cannot pin the buffer at its limit.
+        """
+        batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+        if not batch:
+            return True
+        started = asyncio.get_running_loop().time()
+        try:
+            await self.db.insert_delivery_logs(batch)
+        except asyncio.CancelledError:
+            self.buffer[:0] = batch
+            raise
+        except Exception:
+            self.errors_total += 1
+            self.dropped_total += len(batch)
+            logger.exception("Failed to write %d delivery log events.", len(batch))
+            return False
+        self.last_flush_seconds = asyncio.get_running_loop().time() - started
+        self.written_total += len(batch)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "buffered": len(self.buffer),
+            "max_buffered": self.max_buffered,
+            "recorded_total": self.recorded_total,
+            "written_total": self.written_total,
+            "dropped_total": self.dropped_total,
+            "errors_total": self.errors_total,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
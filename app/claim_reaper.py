@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import logging
+from typing import Optional
+
+from app.audit import DeliveryLogger
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock that lets only one worker reap claims at a time.
+CLAIM_REAPER_LOCK_KEY = 0x6f65636c61696d
+
+
+class ClaimReaper:
+    """
+    Background task that returns CLAIMED notes to PENDING once they were claimed more
+    than `lease` ago, so a note claimed by a plugin that crashed before confirming is
+    delivered to another client. Expired claims are found through the partial index on
+    claim_timestamp and released in batches of `batch_size`, skipping rows locked by
+    concurrent confirms. Every worker runs the task, but an advisory lock lets only one
+    of them release claims at a time; the others skip the run. Each released claim is
+    written to the delivery log as a "claim_expired" event.
+    """
+
+    def __init__(self, db: Database, delivery_logger: DeliveryLogger, lease: datetime.timedelta,
+                 batch_size: int = 500, interval: float = 30.0, batch_pause: float = 0.05):
+        self.db = db
+        self.delivery_logger = delivery_logger
+        self.lease = lease
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batch_pause = batch_pause
+        self.task: Optional[asyncio.Task] = None
+        self.released_total = 0
+        self.batches_total = 0
+        self.skipped_runs_total = 0
+        self.errors_total = 0
+        self.last_run_finished: Optional[datetime.datetime] = None
+        self.last_run_released = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Claim reaper run failed.")
+
+    async def run_once(self) -> int:
+        released_run = 0
+        claimed_before = datetime.datetime.now(datetime.timezone.utc) - self.lease
+        for shard in self.db.shard_names:
+            while True:
+                rows = await self.db.release_expired_claims(claimed_before, self.batch_size, CLAIM_REAPER_LOCK_KEY, shard)
+                if rows is None:
+                    # Another worker is reaping this shard.
+                    self.skipped_runs_total += 1
+                    break
+                self.batches_total += 1
+                self.released_total += len(rows)
+                released_run += len(rows)
+                for row in rows:
+                    self.delivery_logger.record("claim_expired", row["id"], row["vault_id"], row["claim_owner"])
+                if len(rows) < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+        self.last_run_finished = datetime.datetime.now(datetime.timezone.utc)
+        self.last_run_released = released_run
+        if released_run:
+            logger.info("Released %d expired note claims.", released_run)
+        return released_run
+
+    def stats(self) -> dict:
+        return {
+            "lease_seconds": self.lease.total_seconds(),
+            "running": self.task is not None,
+            "released_total": self.released_total,
+            "batches_total": self.batches_total,
+            "skipped_runs_total": self.skipped_runs_total,
+            "errors_total": self.errors_total,
+            "last_run_finished": self.last_run_finished,
+            "last_run_released": self.last_run_released,
+        }
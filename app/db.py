@@ -1,28 +1,465 @@
+import asyncio
+import collections
+import datetime
+import functools
+import hashlib
+import json
 import logging
+import time
 import asyncpg
-from typing import Optional, List
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, List, Tuple, Set, Dict, Union
 from uuid import UUID
-from app.models import User, Vault, Note
+from app.models import User, Vault, Note, NoteSummary, NoteSearchResult, PluginClient, VaultDeletion, VaultNoteStats
+from app.events import NOTE_EVENTS_CHANNEL, CACHE_INVALIDATION_CHANNEL
+from app.cache import BlobCache, TTLCache, MISSING
+from app.shards import MAIN_SHARD, VaultMovedError, place_vault
+from app.metrics import REGISTRY, Counter, Gauge, Histogram
 
 logger = logging.getLogger(__name__)
 
+DB_OPERATION_SECONDS = REGISTRY.register(Histogram(
+    "db_operation_duration_seconds", "Latency of Database methods, including pool waits.", ("operation",),
+))
+DB_OPERATION_ERRORS = REGISTRY.register(Counter(
+    "db_operation_errors_total", "Database methods that raised an exception.", ("operation",),
+))
+DB_POOL_ACQUIRE_SECONDS = REGISTRY.register(Histogram(
+    "db_pool_acquire_duration_seconds", "Time spent waiting for a pool connection.", ("pool",),
+))
+DB_REPLICA_FALLBACKS = REGISTRY.register(Counter(
+    "db_replica_fallbacks_total", "Reads sent to the primary because the replica was behind.",
+))
+NOTE_CLAIMS_EXPIRED = REGISTRY.register(Counter(
+    "note_claims_expired_total", "CLAIMED notes returned to PENDING because their claim lease expired.",
+))
+NOTE_CONTENT_BYTES = REGISTRY.register(Counter(
+    "note_content_bytes_total",
+    "Bytes of deduplicated note bodies: received with new notes, and newly stored in note_contents.", ("kind",),
+))
+REGISTRY.register(Gauge(
+    "note_content_dedup_ratio", "Note body bytes received per byte stored in note_contents by this worker.",
+    callback=lambda: {(): NOTE_CONTENT_BYTES.values.get(("received",), 0.0) / max(NOTE_CONTENT_BYTES.values.get(("stored",), 0.0), 1.0)},
+))
+
+
+def instrumented(func):
+    """
+    Record latency and errors of a Database method under its name.
+    """
+    operation = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_OPERATION_ERRORS.inc(operation)
+            raise
+        finally:
+            DB_OPERATION_SECONDS.observe(time.perf_counter() - started, operation)
+
+    return wrapper
+
+
+# Must match the prefix of content indexed by note_search_vector() (migration 0011).
+SEARCH_INDEXED_CONTENT_LENGTH = 262144
+
+# Tables holding a vault's data, emptied in this order before the vault row is deleted.
+# notes goes first so the retention worker cannot move more rows into notes_archive.
+VAULT_DATA_TABLES = ("notes", "notes_archive", "delivery_logs", "plugin_clients")
+# Tables whose rows hold a reference to a body in note_contents.
+CONTENT_TABLES = ("notes", "notes_archive")
+
+# Length of the fixed windows plugin client polls are counted in.
+CLIENT_POLL_WINDOW_SECONDS = 60
+
+# vault_note_stats column counting the notes in each state.
+NOTE_STATS_COLUMNS = {"PENDING": "pending", "CLAIMED": "claimed", "DELIVERED": "delivered"}
+
+NOTE_COLUMNS = ("id, vault_id, external_id, title, note_body(content, content_hash) AS content, state, claim_owner, "
+                "claim_timestamp, created_at, updated_at")
+NOTE_SUMMARY_COLUMNS = "id, vault_id, external_id, title, state, claim_owner, claim_timestamp, created_at, updated_at"
+
 
 class Database:
-    def __init__(self, dsn: str):
+    """
+    Access to Postgres through an asyncpg pool. When `replica_dsn` is given, read-only
+    listings and downloads go to a second pool on the replica, unless the replica may
+    not have caught up with this caller's own writes yet.
+
+    With `shard_dsns`, the notes of a vault (and everything else scoped to it) may live
+    on one of several Postgres instances, each with its own pool. The main database keeps
+    users, vaults and tokens, and the vault_shards directory that routes every vault.
+    New vaults are placed on one of `shard_placement` by rendezvous hashing.
+    """
+
+    def __init__(self, dsn: str, cache_size: int = 10000, cache_ttl: float = 60.0, negative_cache_ttl: float = 5.0,
+                 pool_options: Optional[dict] = None, replica_dsn: Optional[str] = None,
+                 replica_lag_window: float = 5.0, content_dedup_min_size: int = 2048,
+                 content_cache_size: int = 32 * 1024 * 1024, content_cache_max_item_size: int = 1024 * 1024,
+                 shard_dsns: Optional[Dict[str, str]] = None, shard_placement: Optional[List[str]] = None):
         self.dsn = dsn
+        self.replica_dsn = replica_dsn
+        self.shard_dsns = shard_dsns or {}
+        self.shard_placement = shard_placement or self.shard_names
+        unknown = set(self.shard_placement) - set(self.shard_names)
+        if unknown:
+            raise ValueError(f"Unknown shards in placement: {', '.join(sorted(unknown))}")
+        self.pool_options = pool_options or {}
         self.pool: Optional[asyncpg.pool.Pool] = None
+        self.replica_pool: Optional[asyncpg.pool.Pool] = None
+        self.shard_pools: Dict[str, asyncpg.pool.Pool] = {}
+        self.pool_waiters = {"primary": 0, "replica": 0, **{name: 0 for name in self.shard_dsns}}
+        self.vault_cache = TTLCache(cache_size, cache_ttl, negative_cache_ttl)
+        self.user_cache = TTLCache(cache_size, cache_ttl, negative_cache_ttl)
+        self.version_cache = TTLCache(cache_size, cache_ttl)
+        # vault id -> shard name, from the vault_shards directory.
+        self.shard_cache = TTLCache(cache_size, cache_ttl)
+        # Users whose vaults changed recently; their vault listings are read from the primary.
+        self.recent_vault_writers = TTLCache(cache_size, replica_lag_window)
+        # Bodies of at least this many bytes are stored once in note_contents.
+        self.content_dedup_min_size = content_dedup_min_size
+        self.content_cache = BlobCache(content_cache_size, content_cache_max_item_size)
+
+    @property
+    def shard_names(self) -> List[str]:
+        return [MAIN_SHARD, *self.shard_dsns]
+
+    @asynccontextmanager
+    async def acquire(self, replica: bool = False, shard: str = MAIN_SHARD):
+        """
+        Acquire a pool connection, recording how long the caller waited and how many are waiting.
+        """
+        if shard != MAIN_SHARD:
+            name, pool = shard, self.shard_pools[shard]
+        else:
+            name, pool = ("replica", self.replica_pool) if replica else ("primary", self.pool)
+        self.pool_waiters[name] += 1
+        started = time.perf_counter()
+        try:
+            conn = await pool.acquire()
+        finally:
+            self.pool_waiters[name] -= 1
+            DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - started, name)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    @asynccontextmanager
+    async def acquire_vault(self, vault_id: UUID):
+        """
+        Acquire a connection to the shard holding the vault's data.
+        """
+        async with self.acquire(shard=await self.shard_of(vault_id)) as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def acquire_read(self, vault_id: Optional[UUID] = None, shard: str = MAIN_SHARD):
+        """
+        Acquire a connection for a read-only query. The replica is used only when it has
+        replayed the latest change version this worker knows for the vault (from its own
+        writes or from note events of other workers); otherwise the read goes to the primary.
+        Reads of vaults on other shards than the main one (the replica's) go to that shard.
+        """
+        if vault_id is not None:
+            shard = await self.shard_of(vault_id)
+        if self.replica_pool is None or shard != MAIN_SHARD:
+            async with self.acquire(shard=shard) as conn:
+                yield conn
+            return
+        expected = self.version_cache.get(str(vault_id)) if vault_id is not None else MISSING
+        async with self.acquire(replica=True) as conn:
+            if expected is MISSING or await self._replica_version(conn, vault_id) >= expected:
+                yield conn
+                return
+        DB_REPLICA_FALLBACKS.inc()
+        async with self.acquire() as conn:
+            yield conn
+
+    @staticmethod
+    async def _replica_version(conn: asyncpg.Connection, vault_id: UUID) -> int:
+        version = await conn.fetchval("SELECT version FROM vault_versions WHERE vault_id = $1", str(vault_id))
+        return version or 0
+
+    async def shard_of(self, vault_id: UUID) -> str:
+        """
+        Name of the shard holding the vault's data, looked up in the vault_shards
+        directory and cached until it expires or the vault is moved.
+        """
+        if not self.shard_dsns:
+            return MAIN_SHARD
+        return (await self.shards_of([vault_id]))[str(vault_id)]
+
+    async def shards_of(self, vault_ids: List[UUID]) -> Dict[str, str]:
+        """
+        Shard of each vault by vault id string, with one directory query for all cache misses.
+        """
+        keys = [str(vault_id) for vault_id in vault_ids]
+        if not self.shard_dsns:
+            return {key: MAIN_SHARD for key in keys}
+        shards = {key: self.shard_cache.get(key) for key in keys}
+        missing = [key for key, shard in shards.items() if shard is MISSING]
+        if missing:
+            generation = self.shard_cache.generation
+            async with self.acquire() as conn:
+                rows = await conn.fetch("SELECT vault_id, shard FROM vault_shards WHERE vault_id = ANY($1::uuid[])", missing)
+            placed = {str(row["vault_id"]): row["shard"] for row in rows}
+            for key in missing:
+                shards[key] = placed.get(key, MAIN_SHARD)
+                self.shard_cache.set(key, shards[key], generation)
+        return shards
+
+    async def group_by_shard(self, vault_ids: List[UUID]) -> Dict[str, List[UUID]]:
+        groups: Dict[str, List[UUID]] = defaultdict(list)
+        shards = await self.shards_of(vault_ids)
+        for vault_id in vault_ids:
+            groups[shards[str(vault_id)]].append(vault_id)
+        return groups
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        pools = {"primary": self.pool, "replica": self.replica_pool, **self.shard_pools}
+        return {
+            name: {
+                "size": pool.get_size(),
+                "idle": pool.get_idle_size(),
+                "max_size": pool.get_max_size(),
+                "waiters": self.pool_waiters[name],
+            }
+            for name, pool in pools.items() if pool is not None
+        }
 
     async def connect(self):
-        self.pool = await asyncpg.create_pool(dsn=self.dsn)
-        logger.info("Connected to database.")
+        self.pool = await asyncpg.create_pool(dsn=self.dsn, **self.pool_options)
+        if self.replica_dsn:
+            self.replica_pool = await asyncpg.create_pool(dsn=self.replica_dsn, **self.pool_options)
+        for name, dsn in self.shard_dsns.items():
+            self.shard_pools[name] = await asyncpg.create_pool(dsn=dsn, **self.pool_options)
+        logger.info("Connected to database%s%s.", " and read replica" if self.replica_pool else "",
+                    f" and {len(self.shard_pools)} shards" if self.shard_pools else "")
+
+    async def warm_up(self):
+        """
+        Check out every idle connection of each pool once and run a query touching
+        the custom types, so asyncpg's per-connection type introspection happens now
+        rather than on the first requests after a deploy.
+        """
+        for pool in (self.pool, self.replica_pool, *self.shard_pools.values()):
+            if pool is None:
+                continue
+            connections = [await pool.acquire() for _ in range(pool.get_idle_size())]
+            try:
+                await asyncio.gather(*(
+                    conn.fetchval("SELECT $1::note_state::text", "PENDING") for conn in connections
+                ))
+            finally:
+                for conn in connections:
+                    await pool.release(conn)
+        logger.info("Database pools warmed up.")
+
+    async def ping(self, timeout: float = 1.0) -> bool:
+        """
+        True if a connection of the main database and of every shard can be checked
+        out and answers within `timeout`.
+        """
+        async def select_one(shard: str):
+            async with self.acquire(shard=shard) as conn:
+                return await conn.fetchval("SELECT 1")
+
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*map(select_one, self.shard_names)), timeout)
+        except Exception:
+            return False
+        return all(result == 1 for result in results)
 
     async def close(self):
+        for pool in self.shard_pools.values():
+            await pool.close()
+        self.shard_pools = {}
+        if self.replica_pool:
+            await self.replica_pool.close()
         if self.pool:
             await self.pool.close()
             logger.info("Database connection closed.")
 
+    def cache_stats(self) -> dict:
+        return {
+            "vaults": self.vault_cache.stats(),
+            "users": self.user_cache.stats(),
+            "versions": self.version_cache.stats(),
+            "shards": self.shard_cache.stats(),
+            "contents": self.content_cache.stats(),
+        }
+
+    def handle_cache_invalidation(self, payload: str):
+        """
+        Evict an entry announced on the cache invalidation channel, possibly by another worker.
+        """
+        message = json.loads(payload)
+        caches = {"vaults": self.vault_cache, "users": self.user_cache, "shards": self.shard_cache}
+        caches[message["cache"]].invalidate(message["key"])
+
+    def handle_note_event(self, payload: str):
+        """
+        Track the change version announced with a note event, possibly by another worker.
+        """
+        event = json.loads(payload)
+        self._remember_version(event["vault_id"], event["version"])
+
+    def clear_caches(self):
+        self.vault_cache.clear()
+        self.user_cache.clear()
+        self.version_cache.clear()
+        self.shard_cache.clear()
+
+    def _remember_version(self, vault_id: str, version: int):
+        # Versions only grow, so a slow read must not overwrite a newer notification.
+        cached = self.version_cache.get(vault_id)
+        if cached is MISSING or cached < version:
+            self.version_cache.set(vault_id, version)
+
+    async def _bump_versions(self, conn: asyncpg.Connection, vault_ids: List[str]) -> Dict[str, int]:
+        """
+        Increment the change version of the vaults. A vault being moved to another shard
+        has moved_to set on this shard, so the version row is left alone and the write is
+        refused with VaultMovedError, which rolls back the caller's transaction.
+        """
+        rows = await conn.fetch(
+            """
+            INSERT INTO vault_versions (vault_id, version)
+            SELECT vault_id, 1 FROM unnest($1::uuid[]) AS vault_id
+            ON CONFLICT (vault_id) DO UPDATE SET version = vault_versions.version + 1
+            WHERE vault_versions.moved_to IS NULL
+            RETURNING vault_id, version
+            """,
+            vault_ids
+        )
+        versions = {str(row["vault_id"]): row["version"] for row in rows}
+        moved = [vault_id for vault_id in vault_ids if vault_id not in versions]
+        if moved:
+            for vault_id in moved:
+                self.shard_cache.invalidate(vault_id)
+            raise VaultMovedError(moved)
+        return versions
+
+    async def _publish_note_events(self, conn: asyncpg.Connection, event_type: str, vault_ids: List[str], **fields) -> Dict[str, int]:
+        """
+        Bump the change version of the vaults and announce it on the note events channel.
+        Listeners see the notifications only when the transaction commits.
+        """
+        versions = await self._bump_versions(conn, sorted(set(vault_ids)))
+        payloads = [
+            json.dumps({"type": event_type, "vault_id": vault_id, "version": version, **fields})
+            for vault_id, version in versions.items()
+        ]
+        await conn.execute(
+            "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+            NOTE_EVENTS_CHANNEL, payloads
+        )
+        return versions
+
+    def _remember_versions(self, versions: Dict[str, int]):
+        for vault_id, version in versions.items():
+            self._remember_version(vault_id, version)
+
+    async def _count_notes(self, conn: asyncpg.Connection, counts: Dict[str, int], target: str,
+                           source: Optional[str] = None):
+        """
+        Add the number of notes per vault to the `target` column of vault_note_stats,
+        taking them from the `source` column when the notes moved from another state.
+        Called in the transaction that changed the notes, so the counts commit with them.
+        """
+        moved = f", {source} = vault_note_stats.{source} - EXCLUDED.{target}" if source else ""
+        vault_ids = sorted(counts)
+        await conn.execute(
+            f"""
+            INSERT INTO vault_note_stats (vault_id, {target})
+            SELECT * FROM unnest($1::uuid[], $2::bigint[])
+            ON CONFLICT (vault_id) DO UPDATE
+            SET {target} = vault_note_stats.{target} + EXCLUDED.{target}{moved}, updated_at = NOW()
+            """,
+            vault_ids, [counts[vault_id] for vault_id in vault_ids]
+        )
+
+    def _content_hash(self, content: str) -> Tuple[Optional[bytes], int]:
+        """
+        sha256 and size in bytes of a note body, or no hash when the body is small
+        enough to stay inline in the note row.
+        """
+        data = content.encode()
+        if len(data) < self.content_dedup_min_size:
+            return None, len(data)
+        return hashlib.sha256(data).digest(), len(data)
+
+    async def _release_contents(self, conn: asyncpg.Connection, hashes: List[Optional[bytes]]):
+        """
+        Drop one reference to the body for every hash given, and delete bodies no note
+        refers to anymore. Rows are locked in hash order, the order creates take them in.
+        """
+        refs = collections.Counter(content_hash for content_hash in hashes if content_hash is not None)
+        if not refs:
+            return
+        content_hashes = sorted(refs)
+        await conn.execute(
+            "SELECT 1 FROM note_contents WHERE hash = ANY($1::bytea[]) ORDER BY hash FOR UPDATE", content_hashes
+        )
+        await conn.execute(
+            """
+            UPDATE note_contents c SET refcount = c.refcount - r.refs
+            FROM unnest($1::bytea[], $2::bigint[]) AS r(hash, refs)
+            WHERE c.hash = r.hash
+            """,
+            content_hashes, [refs[content_hash] for content_hash in content_hashes]
+        )
+        await conn.execute(
+            "DELETE FROM note_contents WHERE hash = ANY($1::bytea[]) AND refcount <= 0", content_hashes
+        )
+
+    async def _resolve_content(self, conn: asyncpg.Connection, row: asyncpg.Record) -> Optional[dict]:
+        """
+        Turn a notes row read with its content_hash into note columns, taking a
+        deduplicated body from the content cache or from note_contents.
+        """
+        note = dict(row)
+        content_hash = note.pop("content_hash")
+        if content_hash is None:
+            return note
+        content = self.content_cache.get(content_hash)
+        if content is MISSING:
+            content = await conn.fetchval("SELECT content FROM note_contents WHERE hash = $1", content_hash)
+            if content is None:
+                return None
+            self.content_cache.set(content_hash, content)
+        note["content"] = content
+        return note
+
+    @instrumented
+    async def get_vault_version(self, vault_id: UUID) -> int:
+        """
+        Current change version of the vault's notes. Served from memory while
+        note events keep the cached value up to date.
+        """
+        key = str(vault_id)
+        cached = self.version_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        async with self.acquire_vault(vault_id) as conn:
+            version = await conn.fetchval("SELECT version FROM vault_versions WHERE vault_id = $1", key)
+        self._remember_version(key, version or 0)
+        return self.version_cache.get(key)
+
+    async def _publish_invalidation(self, conn: asyncpg.Connection, cache: str, key: str):
+        await conn.execute(
+            "SELECT pg_notify($1, $2)",
+            CACHE_INVALIDATION_CHANNEL, json.dumps({"cache": cache, "key": key})
+        )
+
+    @instrumented
     async def create_user(self, user: User) -> User:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
                 INSERT INTO users (id, username, email, password_hash, created_at, updated_at)
@@ -34,15 +471,64 @@ class Database:
             )
             return User(**row)
 
+    @instrumented
     async def get_user_by_id(self, user_id: UUID) -> Optional[User]:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM users WHERE id = $1", str(user_id))
+        key = str(user_id)
+        cached = self.user_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        generation = self.user_cache.generation
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM users WHERE id = $1", key)
+        user = User(**row) if row else None
+        self.user_cache.set(key, user, generation)
+        return user
+
+    @instrumented
+    async def get_user_by_username(self, username: str) -> Optional[User]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM users WHERE username = $1", username)
             if row:
                 return User(**row)
             return None
 
+    async def create_vault_stub(self, conn: asyncpg.Connection, vault_id: UUID):
+        """
+        Copy the vault row, and its owner's, from the main database to the shard `conn`
+        belongs to, so the foreign keys of the vault's data hold there. Stubs carry no
+        password hash and no usable token; authentication always reads the main database.
+        """
+        async with self.acquire() as main:
+            user = await main.fetchrow(
+                "SELECT u.* FROM users u JOIN vaults v ON v.user_id = u.id WHERE v.id = $1", str(vault_id)
+            )
+            vault = await main.fetchrow("SELECT * FROM vaults WHERE id = $1", str(vault_id))
+        await conn.execute(
+            """
+            INSERT INTO users (id, username, email, password_hash, created_at, updated_at)
+            VALUES ($1, $2, $3, '', $4, $5)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            user["id"], user["username"], user["email"], user["created_at"], user["updated_at"]
+        )
+        await conn.execute(
+            """
+            INSERT INTO vaults (id, user_id, name, token, created_at, updated_at)
+            VALUES ($1, $2, $3, 'shard-stub-' || $1::text, $4, $5)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            vault["id"], vault["user_id"], vault["name"], vault["created_at"], vault["updated_at"]
+        )
+
+    @instrumented
     async def create_vault(self, vault: Vault) -> Vault:
-        async with self.pool.acquire() as conn:
+        """
+        Insert the vault on the main database and place it on a shard. The shard's stub
+        rows are written once the vault exists, and the directory entry is written last,
+        so a vault is never routed to a shard that cannot hold its notes.
+        """
+        shard = place_vault(vault.id, self.shard_placement) if self.shard_dsns else MAIN_SHARD
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
                 INSERT INTO vaults (id, user_id, name, token, created_at, updated_at)
@@ -52,119 +538,951 @@ class Database:
                 str(vault.id), str(vault.user_id), vault.name, vault.token,
                 vault.created_at, vault.updated_at
             )
-            return Vault(**row)
+        if shard != MAIN_SHARD:
+            async with self.acquire(shard=shard) as conn:
+                await self.create_vault_stub(conn, vault.id)
+            async with self.acquire() as conn:
+                await conn.execute("INSERT INTO vault_shards (vault_id, shard) VALUES ($1, $2)", str(vault.id), shard)
+        self.shard_cache.set(str(vault.id), shard)
+        self.recent_vault_writers.set(str(vault.user_id), True)
+        return Vault(**row)
 
-    async def get_vault_by_token(self, token: str) -> Optional[Vault]:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM vaults WHERE token = $1", token)
-            if row:
-                return Vault(**row)
-            return None
+    def get_cached_vault_by_token(self, token: str) -> Union[Vault, None, object]:
+        """
+        The cached result of get_vault_by_token, without touching the database:
+        the vault, None for a token known to be invalid, or MISSING.
+        """
+        return self.vault_cache.get(token)
 
-    async def create_note(self, note: Note) -> Note:
-        async with self.pool.acquire() as conn:
+    @instrumented
+    async def get_vault_by_token(self, token: str, use_cache: bool = True) -> Optional[Vault]:
+        """
+        Resolve a vault token. Results, including unknown tokens, are cached
+        until they expire or the vault is changed. Callers that have just missed
+        get_cached_vault_by_token pass `use_cache=False`.
+        """
+        if use_cache:
+            cached = self.vault_cache.get(token)
+            if cached is not MISSING:
+                return cached
+        generation = self.vault_cache.generation
+        shard_generation = self.shard_cache.generation
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """
-                INSERT INTO notes (id, vault_id, external_id, title, content, state, claim_owner, claim_timestamp, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                RETURNING id, vault_id, external_id, title, content, state, claim_owner, claim_timestamp, created_at, updated_at
+                SELECT v.*, coalesce(s.shard, $2) AS shard FROM vaults v
+                LEFT JOIN vault_shards s ON s.vault_id = v.id
+                WHERE v.token = $1 AND v.deleted_at IS NULL
                 """,
-                str(note.id), str(note.vault_id), note.external_id, note.title,
-                note.content, note.state.value, note.claim_owner, note.claim_timestamp,
-                note.created_at, note.updated_at
+                token, MAIN_SHARD
             )
-            return Note(**row)
+        vault = Vault(**row) if row else None
+        self.vault_cache.set(token, vault, generation)
+        if row:
+            # The request will most likely touch the vault's notes next.
+            self.shard_cache.set(str(row["id"]), row["shard"], shard_generation)
+        return vault
 
-    async def claim_note(self, note_id: UUID, client_id: str) -> Optional[Note]:
+    @instrumented
+    async def create_note(self, note: Note) -> Note:
         """
-        Try too claim a note. If the note is in 'PENDING' state, change it to 'CLAIMED',
-        write client_id and timestamp.
+        Insert a note and notify listeners of its vault. The notification is
+        delivered only when the transaction commits. If the vault already has a note
+        with the same external_id, live or archived, that note is returned and nothing
+        is inserted.
+        Large bodies are stored once in note_contents, keyed by their sha256.
         """
-        async with self.pool.acquire() as conn:
+        content_hash, size = self._content_hash(note.content)
+        async with self.acquire_vault(note.vault_id) as conn:
             async with conn.transaction():
                 row = await conn.fetchrow(
+                    f"""
+                    WITH inserted AS (
+                        INSERT INTO notes (id, vault_id, external_id, title, content, content_hash, search_vector,
+                                           state, claim_owner, claim_timestamp, created_at, updated_at)
+                        SELECT $1::uuid, $2::uuid, $3::text, $4::text, CASE WHEN $11::bytea IS NULL THEN $5::text END, $11,
+                               note_search_vector($4, $5), $6::note_state, $7::text, $8::timestamptz, $9::timestamptz,
+                               $10::timestamptz
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM notes_archive WHERE vault_id = $2 AND external_id = $3
+                        )
+                        ON CONFLICT (vault_id, external_id) WHERE external_id IS NOT NULL DO NOTHING
+                        RETURNING {NOTE_SUMMARY_COLUMNS}, content_hash
+                    ), stored AS (
+                        INSERT INTO note_contents (hash, content, size, refcount)
+                        SELECT content_hash, $5, $12, 1 FROM inserted WHERE content_hash IS NOT NULL
+                        ON CONFLICT (hash) DO UPDATE SET refcount = note_contents.refcount + 1
+                        RETURNING xmax = 0 AS created
+                    )
+                    SELECT {NOTE_SUMMARY_COLUMNS}, coalesce((SELECT created FROM stored), false) AS content_stored
+                    FROM inserted
+                    """,
+                    str(note.id), str(note.vault_id), note.external_id, note.title,
+                    note.content, note.state.value, note.claim_owner, note.claim_timestamp,
+                    note.created_at, note.updated_at, content_hash, size
+                )
+                if row is None:
+                    row = await conn.fetchrow(
+                        f"""
+                        (SELECT {NOTE_COLUMNS} FROM notes WHERE vault_id = $1 AND external_id = $2)
+                        UNION ALL
+                        (SELECT {NOTE_COLUMNS} FROM notes_archive WHERE vault_id = $1 AND external_id = $2)
+                        LIMIT 1
+                        """,
+                        str(note.vault_id), note.external_id
+                    )
+                    return Note(**row)
+                await self._count_notes(conn, {str(row["vault_id"]): 1}, NOTE_STATS_COLUMNS[row["state"]])
+                versions = await self._publish_note_events(
+                    conn, "note_created", [str(row["vault_id"])], note_id=str(row["id"])
+                )
+        self._remember_versions(versions)
+        if content_hash is not None:
+            NOTE_CONTENT_BYTES.inc("received", amount=size)
+            if row["content_stored"]:
+                NOTE_CONTENT_BYTES.inc("stored", amount=size)
+        note_row = dict(row)
+        del note_row["content_stored"]
+        return Note(**note_row, content=note.content)
+
+    @instrumented
+    async def create_notes_batch(self, vault_id: UUID, notes: List[Note]) -> Tuple[Set[UUID], Dict[str, UUID]]:
+        """
+        Insert many PENDING notes of one vault with a single INSERT ... SELECT FROM unnest(...).
+        Notes whose external_id already exists in the vault, live or archived, or earlier in the
+        batch are skipped.
+        Returns the ids that were inserted and the id stored for every external_id in the batch.
+        """
+        external_ids = list({note.external_id for note in notes if note.external_id is not None})
+        hashed = [self._content_hash(note.content) for note in notes]
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                inserted = await conn.fetch(
                     """
+                    WITH batch AS (
+                        SELECT * FROM unnest($2::uuid[], $3::text[], $4::text[], $5::text[], $6::timestamptz[], $7::bytea[])
+                            AS t(id, external_id, title, content, created_at, content_hash)
+                    ), inserted AS (
+                        INSERT INTO notes (id, vault_id, external_id, title, content, content_hash, search_vector,
+                                           state, created_at, updated_at)
+                        SELECT id, $1, external_id, title, CASE WHEN content_hash IS NULL THEN content END, content_hash,
+                               note_search_vector(title, content), 'PENDING', created_at, created_at
+                        FROM batch
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM notes_archive a WHERE a.vault_id = $1 AND a.external_id = batch.external_id
+                        )
+                        ON CONFLICT (vault_id, external_id) WHERE external_id IS NOT NULL DO NOTHING
+                        RETURNING id, content_hash
+                    ), stored AS (
+                        INSERT INTO note_contents (hash, content, size, refcount)
+                        SELECT b.content_hash, b.content, octet_length(b.content), r.refs
+                        FROM (
+                            SELECT content_hash, count(*) AS refs FROM inserted
+                            WHERE content_hash IS NOT NULL GROUP BY content_hash
+                        ) r
+                        JOIN (
+                            SELECT DISTINCT ON (content_hash) content_hash, content FROM batch
+                            WHERE content_hash IS NOT NULL ORDER BY content_hash
+                        ) b USING (content_hash)
+                        ORDER BY b.content_hash
+                        ON CONFLICT (hash) DO UPDATE SET refcount = note_contents.refcount + EXCLUDED.refcount
+                        RETURNING size, xmax = 0 AS created
+                    )
+                    SELECT id, content_hash IS NOT NULL AS deduplicated,
+                           (SELECT coalesce(sum(size) FILTER (WHERE created), 0) FROM stored) AS stored_bytes
+                    FROM inserted
+                    """,
+                    str(vault_id),
+                    [str(note.id) for note in notes],
+                    [note.external_id for note in notes],
+                    [note.title for note in notes],
+                    [note.content for note in notes],
+                    [note.created_at for note in notes],
+                    [content_hash for content_hash, _ in hashed],
+                )
+                existing = []
+                if external_ids:
+                    existing = await conn.fetch(
+                        """
+                        SELECT external_id, id FROM notes WHERE vault_id = $1 AND external_id = ANY($2::text[])
+                        UNION ALL
+                        SELECT external_id, id FROM notes_archive WHERE vault_id = $1 AND external_id = ANY($2::text[])
+                        """,
+                        str(vault_id), external_ids
+                    )
+                if inserted:
+                    await self._count_notes(conn, {str(vault_id): len(inserted)}, "pending")
+                    versions = await self._publish_note_events(
+                        conn, "notes_created", [str(vault_id)], count=len(inserted)
+                    )
+        if inserted:
+            self._remember_versions(versions)
+            inserted_ids = {str(row["id"]) for row in inserted if row["deduplicated"]}
+            received = sum(size for note, (content_hash, size) in zip(notes, hashed)
+                           if content_hash is not None and str(note.id) in inserted_ids)
+            if received:
+                NOTE_CONTENT_BYTES.inc("received", amount=received)
+                NOTE_CONTENT_BYTES.inc("stored", amount=inserted[0]["stored_bytes"])
+        return {row["id"] for row in inserted}, {row["external_id"]: row["id"] for row in existing}
+
+    @instrumented
+    async def claim_note(self, note_id: UUID, vault_id: UUID, client_id: str) -> Optional[Note]:
+        """
+        Try too claim a note of the vault. If the note is in 'PENDING' state, change it to 'CLAIMED',
+        write client_id and timestamp.
+        """
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    f"""
                     UPDATE notes
                     SET state = 'CLAIMED',
                         claim_owner = $2,
                         claim_timestamp = NOW(),
                         updated_at = NOW()
-                    WHERE id = $1 AND state = 'PENDING'
-                    RETURNING id, vault_id, external_id, title, content, state, claim_owner, claim_timestamp, created_at, updated_at
+                    WHERE id = $1 AND vault_id = $3 AND state = 'PENDING'
+                    RETURNING {NOTE_COLUMNS}
                     """,
-                    str(note_id), client_id
+                    str(note_id), client_id, str(vault_id)
                 )
-                if row:
-                    return Note(**row)
-            return None
+                if row is None:
+                    return None
+                await self._count_notes(conn, {str(row["vault_id"]): 1}, "claimed", source="pending")
+                versions = await self._publish_note_events(
+                    conn, "note_claimed", [str(row["vault_id"])], note_id=str(row["id"])
+                )
+        self._remember_versions(versions)
+        return Note(**row)
 
-    async def download_note(self, note_id: UUID) -> Optional[Note]:
+    @instrumented
+    async def download_note(self, note_id: UUID, raw: bool = False, vault_id: Optional[UUID] = None,
+                            max_content_length: Optional[int] = None) -> Optional[Union[Note, dict]]:
         """
-        Get note for download.
+        Get note for download. With `raw`, the note columns are returned as a plain dict.
+        Reads may be served by the replica; `vault_id` lets the caller's recent writes
+        to the vault (such as the claim before a download) route the read to the primary.
+        Deduplicated bodies of recently downloaded notes are served from the content cache.
+        A body longer than `max_content_length` characters is not read at all: the note is
+        returned as a dict with content None, content_length and content_hash, for
+        read_note_content to stream.
         """
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM notes WHERE id = $1", str(note_id))
-            if row:
-                return Note(**row)
-            return None
+        query = """
+            SELECT id, vault_id, external_id, title,
+                   CASE WHEN $2::bigint IS NULL OR body.length <= $2 THEN content END AS content,
+                   state, claim_owner, claim_timestamp, created_at, updated_at, content_hash,
+                   body.length AS content_length
+            FROM notes, LATERAL (SELECT char_length(note_body(content, content_hash)) AS length) body
+            WHERE id = $1
+        """
+
+        async def fetch(conn: asyncpg.Connection) -> Optional[dict]:
+            row = await conn.fetchrow(query, str(note_id), max_content_length)
+            if row is None:
+                return None
+            if max_content_length is not None and row["content_length"] > max_content_length:
+                return dict(row)
+            note = await self._resolve_content(conn, row)
+            if note is not None:
+                del note["content_length"]
+            return note
+
+        async with self.acquire_read(vault_id) as conn:
+            note = await fetch(conn)
+        shard = await self.shard_of(vault_id) if vault_id is not None else MAIN_SHARD
+        if note is None and self.replica_pool is not None and shard == MAIN_SHARD:
+            async with self.acquire() as conn:
+                note = await fetch(conn)
+        if note is None or raw or note["content"] is None:
+            return note
+        return Note(**note)
 
-    async def confirm_note(self, note_id: UUID) -> Optional[Note]:
+    async def read_note_content(self, note: dict, vault_id: UUID, chunk_size: int) -> AsyncIterator[str]:
         """
-        Confirm note delivery. If the note is in 'CLAIMED' state, change it to 'DELIVERED'.
+        Yield the body of a note returned by download_note without content, `chunk_size`
+        characters at a time. Each chunk is a separate substr query on a briefly held
+        connection of the vault's primary, so a slow reader neither holds a connection
+        nor makes the worker keep the whole body in memory. Deduplicated bodies are read
+        by their hash and cannot change in between; inline ones are read from the note row.
         """
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                """
-                UPDATE notes
-                SET state = 'DELIVERED', updated_at = NOW()
-                WHERE id = $1 AND state = 'CLAIMED'
-                RETURNING id, vault_id, external_id, title, content, state, claim_owner, claim_timestamp, created_at, updated_at
-                """,
-                str(note_id)
-            )
-            if row:
-                return Note(**row)
-            return None
+        for start in range(1, note["content_length"] + 1, chunk_size):
+            async with self.acquire_vault(vault_id) as conn:
+                if note["content_hash"] is not None:
+                    chunk = await conn.fetchval(
+                        "SELECT substr(content, $2, $3) FROM note_contents WHERE hash = $1",
+                        note["content_hash"], start, chunk_size
+                    )
+                else:
+                    chunk = await conn.fetchval(
+                        "SELECT substr(content, $2, $3) FROM notes WHERE id = $1", str(note["id"]), start, chunk_size
+                    )
+            if chunk is None:
+                # The note was deleted mid-download; the status line is already sent, so abort.
+                raise RuntimeError(f"Content of note {note['id']} disappeared during download")
+            yield chunk
+
+    @instrumented
+    async def confirm_note(self, note_id: UUID, vault_id: UUID, client_id: str) -> Optional[Note]:
+        """
+        Confirm note delivery. If the note of the vault is CLAIMED by `client_id`, change it
+        to 'DELIVERED', so a client whose lease expired cannot confirm a note another
+        client has claimed since.
+        """
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    f"""
+                    UPDATE notes
+                    SET state = 'DELIVERED', updated_at = NOW()
+                    WHERE id = $1 AND vault_id = $2 AND state = 'CLAIMED' AND claim_owner = $3
+                    RETURNING {NOTE_COLUMNS}
+                    """,
+                    str(note_id), str(vault_id), client_id
+                )
+                if row is None:
+                    return None
+                await self._count_notes(conn, {str(row["vault_id"]): 1}, "delivered", source="claimed")
+                versions = await self._publish_note_events(
+                    conn, "note_delivered", [str(row["vault_id"])], note_id=str(row["id"])
+                )
+        self._remember_versions(versions)
+        return Note(**row)
 
+    @instrumented
+    async def claim_notes_batch(self, vault_id: UUID, client_id: str, limit: int = 10) -> List[Note]:
+        """
+        Claim up to `limit` PENDING notes of the vault in a single statement.
+        Rows locked by concurrent claimers are skipped instead of waited on.
+        """
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    f"""
+                    UPDATE notes
+                    SET state = 'CLAIMED',
+                        claim_owner = $2,
+                        claim_timestamp = NOW(),
+                        updated_at = NOW()
+                    WHERE id IN (
+                        SELECT id FROM notes
+                        WHERE vault_id = $1 AND state = 'PENDING'
+                        ORDER BY created_at ASC
+                        LIMIT $3
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING {NOTE_COLUMNS}
+                    """,
+                    str(vault_id), client_id, limit
+                )
+                if not rows:
+                    return []
+                await self._count_notes(conn, {str(vault_id): len(rows)}, "claimed", source="pending")
+                versions = await self._publish_note_events(conn, "notes_claimed", [str(vault_id)], count=len(rows))
+        self._remember_versions(versions)
+        notes = [Note(**row) for row in rows]
+        notes.sort(key=lambda note: note.created_at)
+        return notes
+
+    @instrumented
+    async def confirm_notes_batch(self, vault_id: UUID, note_ids: List[UUID], client_id: str) -> List[Note]:
+        """
+        Confirm delivery of several notes at once. Only notes of the vault CLAIMED by
+        `client_id` are changed.
+        """
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    f"""
+                    UPDATE notes
+                    SET state = 'DELIVERED', updated_at = NOW()
+                    WHERE vault_id = $1 AND id = ANY($2::uuid[]) AND state = 'CLAIMED' AND claim_owner = $3
+                    RETURNING {NOTE_COLUMNS}
+                    """,
+                    str(vault_id), [str(note_id) for note_id in note_ids], client_id
+                )
+                if not rows:
+                    return []
+                await self._count_notes(conn, {str(vault_id): len(rows)}, "delivered", source="claimed")
+                versions = await self._publish_note_events(conn, "notes_delivered", [str(vault_id)], count=len(rows))
+        self._remember_versions(versions)
+        return [Note(**row) for row in rows]
+
+    @instrumented
     async def get_vaults_by_user(self, user_id: UUID) -> List[Vault]:
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT * FROM vaults WHERE user_id = $1", str(user_id))
+        replica = self.replica_pool is not None and self.recent_vault_writers.get(str(user_id)) is MISSING
+        async with self.acquire(replica=replica) as conn:
+            rows = await conn.fetch("SELECT * FROM vaults WHERE user_id = $1 AND deleted_at IS NULL", str(user_id))
             return [Vault(**row) for row in rows]
 
+    @instrumented
     async def get_user_vault(self, vault_id: UUID, user_id: UUID) -> Optional[Vault]:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM vaults WHERE id = $1 AND user_id = $2", str(vault_id), str(user_id))
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM vaults WHERE id = $1 AND user_id = $2 AND deleted_at IS NULL", str(vault_id), str(user_id)
+            )
             if row:
                 return Vault(**row)
             return None
 
+    @instrumented
     async def update_vault(self, vault_id: UUID, name: str, user_id: UUID) -> Optional[Vault]:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    "UPDATE vaults SET name = $1, updated_at = NOW() WHERE id = $2 AND user_id = $3 AND deleted_at IS NULL RETURNING *",
+                    name, str(vault_id), str(user_id)
+                )
+                if row:
+                    await self._publish_invalidation(conn, "vaults", row["token"])
+        if row:
+            self.vault_cache.invalidate(row["token"])
+            self.recent_vault_writers.set(str(user_id), True)
+            return Vault(**row)
+        return None
+
+    @instrumented
+    async def delete_vault(self, vault_id: UUID, user_id: UUID) -> Optional[VaultDeletion]:
+        """
+        Mark the vault as deleted, which revokes its token on every worker right away,
+        and queue the removal of its data for purge_vault_batch.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                token = await conn.fetchval(
+                    """
+                    UPDATE vaults SET deleted_at = NOW(), updated_at = NOW()
+                    WHERE id = $1 AND user_id = $2 AND deleted_at IS NULL
+                    RETURNING token
+                    """,
+                    str(vault_id), str(user_id)
+                )
+                if token is None:
+                    return None
+                row = await conn.fetchrow(
+                    """
+                    INSERT INTO vault_deletions (vault_id, user_id) VALUES ($1, $2)
+                    ON CONFLICT (vault_id) DO UPDATE SET requested_at = NOW(), finished_at = NULL
+                    RETURNING *
+                    """,
+                    str(vault_id), str(user_id)
+                )
+                await self._publish_invalidation(conn, "vaults", token)
+        self.vault_cache.invalidate(token)
+        self.recent_vault_writers.set(str(user_id), True)
+        return VaultDeletion(**row)
+
+    @instrumented
+    async def get_vault_deletion(self, vault_id: UUID, user_id: UUID) -> Optional[VaultDeletion]:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
-                "UPDATE vaults SET name = $1, updated_at = NOW() WHERE id = $2 AND user_id = $3 RETURNING *",
-                name, str(vault_id), str(user_id)
+                "SELECT * FROM vault_deletions WHERE vault_id = $1 AND user_id = $2", str(vault_id), str(user_id)
             )
-            if row:
-                return Vault(**row)
-            return None
+            return VaultDeletion(**row) if row else None
 
-    async def delete_vault(self, vault_id: UUID, user_id: UUID) -> bool:
-        async with self.pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM vaults WHERE id = $1 AND user_id = $2", str(vault_id), str(user_id))
-            return result.split()[-1] != "0"
+    @instrumented
+    async def get_pending_vault_deletions(self) -> List[UUID]:
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT vault_id FROM vault_deletions WHERE finished_at IS NULL ORDER BY requested_at")
+            return [row["vault_id"] for row in rows]
 
-    async def get_notes_by_vault(self, vault_id: UUID, limit: int = 10, offset: int = 0) -> List[Note]:
-        async with self.pool.acquire() as conn:
+    async def delete_vault_rows(self, conn: asyncpg.Connection, vault_id: UUID, limit: int) -> int:
+        """
+        Delete up to `limit` rows of the vault's data from the first table that has any,
+        releasing their bodies. Returns the number of rows deleted.
+        """
+        for table in VAULT_DATA_TABLES:
+            content_hash = "content_hash" if table in CONTENT_TABLES else "NULL::bytea"
             rows = await conn.fetch(
-                "SELECT * FROM notes WHERE vault_id = $1 ORDER BY created_at ASC LIMIT $2 OFFSET $3",
-                str(vault_id), limit, offset
+                f"""
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM {table} WHERE vault_id = $1 LIMIT $2 FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {content_hash} AS content_hash
+                """,
+                str(vault_id), limit
             )
-            return [Note(**dict(row)) for row in rows]
+            if rows:
+                await self._release_contents(conn, [row["content_hash"] for row in rows])
+                return len(rows)
+        return 0
 
-    async def get_notes_by_state(self, vault_id: UUID, state: str, limit: int = 10, offset: int = 0) -> List[Note]:
-        async with self.pool.acquire() as conn:
+    async def _drop_vault(self, conn: asyncpg.Connection, vault_id: UUID, stub: bool = False) -> int:
+        """
+        Delete the notes the batches left on the shard of `conn`, then the vault row, which
+        cascades to the rest. Unlike the batches this waits for rows locked by writes in
+        flight, so only the bodies of rows this transaction deleted are released.
+        Returns the number of notes deleted.
+        """
+        deleted = 0
+        for table in CONTENT_TABLES:
+            rows = await conn.fetch(f"DELETE FROM {table} WHERE vault_id = $1 RETURNING content_hash", str(vault_id))
+            await self._release_contents(conn, [row["content_hash"] for row in rows])
+            deleted += len(rows)
+        deleted_only = "" if stub else " AND deleted_at IS NOT NULL"
+        await conn.execute(f"DELETE FROM vaults WHERE id = $1{deleted_only}", str(vault_id))
+        return deleted
+
+    @instrumented
+    async def purge_vault_batch(self, vault_id: UUID, limit: int) -> Optional[Tuple[int, bool]]:
+        """
+        Delete up to `limit` rows belonging to a deleted vault, one table at a time.
+        Once a batch finds nothing, the rest is deleted waiting for locks, the vault row
+        itself is deleted, along with its stub rows on every shard, and the deletion
+        marked finished. Returns the number of rows deleted and whether the vault is gone.
+        Runs under a transaction-level advisory lock on the vault id, so two workers never
+        purge the same vault at once; returns None when another worker holds it.
+        """
+        shard = await self.shard_of(vault_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext($1::text))", str(vault_id)):
+                    return None
+                if shard == MAIN_SHARD:
+                    deleted = await self.delete_vault_rows(conn, vault_id, limit)
+                else:
+                    async with self.acquire(shard=shard) as shard_conn:
+                        async with shard_conn.transaction():
+                            deleted = await self.delete_vault_rows(shard_conn, vault_id, limit)
+                finished = not deleted
+                if finished:
+                    # Also covers the tombstones left behind on shards the vault was moved away from.
+                    for name in self.shard_dsns:
+                        async with self.acquire(shard=name) as shard_conn:
+                            async with shard_conn.transaction():
+                                deleted += await self._drop_vault(shard_conn, vault_id, stub=True)
+                    deleted += await self._drop_vault(conn, vault_id)
+                await conn.execute(
+                    """
+                    UPDATE vault_deletions
+                    SET rows_deleted = rows_deleted + $2,
+                        finished_at = CASE WHEN $3 THEN NOW() ELSE finished_at END
+                    WHERE vault_id = $1
+                    """,
+                    str(vault_id), deleted, finished
+                )
+        if finished:
+            self.shard_cache.invalidate(str(vault_id))
+        return deleted, finished
+
+    async def set_vault_shard(self, vault_id: UUID, shard: str):
+        """
+        Point the directory entry of a moved vault at its new shard and make every
+        worker look the route up again.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE vault_shards SET shard = $2, moving_to = NULL, updated_at = NOW() WHERE vault_id = $1",
+                    str(vault_id), shard
+                )
+                await self._publish_invalidation(conn, "shards", str(vault_id))
+        self.shard_cache.invalidate(str(vault_id))
+
+    @instrumented
+    async def get_note_stats(self, vault_ids: List[UUID]) -> Dict[UUID, VaultNoteStats]:
+        """
+        Note counts per state of the given vaults, read from vault_note_stats.
+        Vaults that never had a note get zero counts.
+        """
+        stats = {}
+        for shard, shard_vault_ids in (await self.group_by_shard(vault_ids)).items():
+            async with self.acquire_read(shard=shard) as conn:
+                rows = await conn.fetch(
+                    "SELECT * FROM vault_note_stats WHERE vault_id = ANY($1::uuid[])",
+                    [str(vault_id) for vault_id in shard_vault_ids]
+                )
+            stats.update((str(row["vault_id"]), VaultNoteStats(**row)) for row in rows)
+        return {vault_id: stats.get(str(vault_id)) or VaultNoteStats(vault_id=vault_id) for vault_id in vault_ids}
+
+    @instrumented
+    async def get_vault_ids(self, after: Optional[UUID] = None, limit: int = 100) -> List[UUID]:
+        """
+        Ids of vaults that are not deleted, in id order, starting after `after`.
+        """
+        async with self.acquire() as conn:
             rows = await conn.fetch(
-                "SELECT * FROM notes WHERE vault_id = $1 AND state = $2 ORDER BY created_at ASC LIMIT $3 OFFSET $4",
-                str(vault_id), state, limit, offset
+                """
+                SELECT id FROM vaults
+                WHERE deleted_at IS NULL AND ($1::uuid IS NULL OR id > $1::uuid)
+                ORDER BY id
+                LIMIT $2
+                """,
+                str(after) if after is not None else None, limit
             )
-            return [Note(**dict(row)) for row in rows]
+            return [row["id"] for row in rows]
+
+    @instrumented
+    async def reconcile_note_stats(self, vault_id: UUID, lock_key: int,
+                                   min_age: datetime.timedelta = datetime.timedelta(0)) -> Optional[bool]:
+        """
+        Recount the notes of the vault and overwrite its vault_note_stats row.
+        The row is locked before counting, so a concurrent claim or confirm waits and
+        then applies its change on top of the fresh counts instead of being lost.
+        Runs under the transaction-level advisory lock `lock_key`, so workers do not
+        recount at the same time. Returns None, counting nothing, when another worker
+        holds the lock or the vault was recounted less than `min_age` ago; otherwise
+        returns True when the stored counts had drifted.
+        """
+        async with self.acquire_vault(vault_id) as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", lock_key):
+                    return None
+                try:
+                    await conn.execute(
+                        "INSERT INTO vault_note_stats (vault_id) VALUES ($1) ON CONFLICT (vault_id) DO NOTHING", str(vault_id)
+                    )
+                except asyncpg.ForeignKeyViolationError:
+                    # The vault was purged since it was listed.
+                    return False
+                stored = await conn.fetchrow(
+                    """
+                    SELECT pending, claimed, delivered, archived, coalesce(reconciled_at > NOW() - $2::interval, false) AS fresh
+                    FROM vault_note_stats WHERE vault_id = $1 FOR UPDATE
+                    """,
+                    str(vault_id), min_age
+                )
+                if stored["fresh"]:
+                    return None
+                actual = await conn.fetchrow(
+                    """
+                    SELECT count(*) FILTER (WHERE state = 'PENDING') AS pending,
+                           count(*) FILTER (WHERE state = 'CLAIMED') AS claimed,
+                           count(*) FILTER (WHERE state = 'DELIVERED') AS delivered,
+                           (SELECT count(*) FROM notes_archive WHERE vault_id = $1) AS archived
+                    FROM notes WHERE vault_id = $1
+                    """,
+                    str(vault_id)
+                )
+                await conn.execute(
+                    """
+                    UPDATE vault_note_stats
+                    SET pending = $2, claimed = $3, delivered = $4, archived = $5, reconciled_at = NOW()
+                    WHERE vault_id = $1
+                    """,
+                    str(vault_id), actual["pending"], actual["claimed"], actual["delivered"], actual["archived"]
+                )
+        stored = {key: stored[key] for key in actual.keys()}
+        if stored != dict(actual):
+            logger.warning("Note stats of vault %s drifted: stored %s, counted %s.", vault_id, stored, dict(actual))
+            return True
+        return False
+
+    @instrumented
+    async def get_notes_by_vault(self, vault_id: UUID, limit: int = 10, offset: int = 0,
+                                 after: Optional[Tuple[datetime.datetime, UUID]] = None,
+                                 summary: bool = False, raw: bool = False) -> List[Union[Note, NoteSummary, asyncpg.Record]]:
+        """
+        List notes of the vault ordered by (created_at, id). When `after` is given,
+        the page starts right after that key, which keeps deep pages an index range scan.
+        With `summary`, content is not read at all and NoteSummary objects are returned.
+        With `raw`, the asyncpg records are returned as is, for the fast serialization path.
+        """
+        columns, model = (NOTE_SUMMARY_COLUMNS, NoteSummary) if summary else (NOTE_COLUMNS, Note)
+        async with self.acquire_read(vault_id) as conn:
+            if after is None:
+                rows = await conn.fetch(
+                    f"SELECT {columns} FROM notes WHERE vault_id = $1 ORDER BY created_at ASC, id ASC LIMIT $2 OFFSET $3",
+                    str(vault_id), limit, offset
+                )
+            else:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {columns} FROM notes
+                    WHERE vault_id = $1 AND (created_at, id) > ($2, $3)
+                    ORDER BY created_at ASC, id ASC
+                    LIMIT $4
+                    """,
+                    str(vault_id), after[0], str(after[1]), limit
+                )
+            if raw:
+                return rows
+            return [model(**dict(row)) for row in rows]
+
+    @instrumented
+    async def get_notes_by_state(self, vault_id: UUID, state: str, limit: int = 10, offset: int = 0,
+                                 after: Optional[Tuple[datetime.datetime, UUID]] = None,
+                                 summary: bool = False, raw: bool = False) -> List[Union[Note, NoteSummary, asyncpg.Record]]:
+        columns, model = (NOTE_SUMMARY_COLUMNS, NoteSummary) if summary else (NOTE_COLUMNS, Note)
+        async with self.acquire_read(vault_id) as conn:
+            if after is None:
+                rows = await conn.fetch(
+                    f"SELECT {columns} FROM notes WHERE vault_id = $1 AND state = $2 ORDER BY created_at ASC, id ASC LIMIT $3 OFFSET $4",
+                    str(vault_id), state, limit, offset
+                )
+            else:
+                rows = await conn.fetch(
+                    f"""
+                    SELECT {columns} FROM notes
+                    WHERE vault_id = $1 AND state = $2 AND (created_at, id) > ($3, $4)
+                    ORDER BY created_at ASC, id ASC
+                    LIMIT $5
+                    """,
+                    str(vault_id), state, after[0], str(after[1]), limit
+                )
+            if raw:
+                return rows
+            return [model(**dict(row)) for row in rows]
+
+    @instrumented
+    async def insert_delivery_logs(self, records: List[tuple]):
+        """
+        Append (note_id, vault_id, event_type, client, event_timestamp, details) rows to delivery_logs with COPY.
+        Events of vaults deleted since they were recorded are discarded.
+        Each vault's events are written to its shard.
+        """
+        shards = await self.shards_of(list({record[1] for record in records}))
+        by_shard = defaultdict(list)
+        for record in records:
+            by_shard[shards[str(record[1])]].append(record)
+        columns = ["note_id", "vault_id", "event_type", "client", "event_timestamp", "details"]
+        for shard, shard_records in by_shard.items():
+            async with self.acquire(shard=shard) as conn:
+                try:
+                    await conn.copy_records_to_table("delivery_logs", records=shard_records, columns=columns)
+                except asyncpg.ForeignKeyViolationError:
+                    existing = {
+                        str(row["id"]) for row in await conn.fetch(
+                            "SELECT id FROM vaults WHERE id = ANY($1::uuid[])",
+                            list({str(record[1]) for record in shard_records})
+                        )
+                    }
+                    shard_records = [record for record in shard_records if str(record[1]) in existing]
+                    if shard_records:
+                        await conn.copy_records_to_table("delivery_logs", records=shard_records, columns=columns)
+
+    @instrumented
+    async def upsert_plugin_clients(self, clients: List[Tuple[str, str, datetime.datetime, int, int]]):
+        """
+        Record (vault_id, client_identifier, last_seen, polls, claims) heartbeats of many clients
+        in one statement per shard. Clients of vaults deleted in the meantime are skipped.
+        """
+        shards = await self.shards_of(list({client[0] for client in clients}))
+        by_shard = defaultdict(list)
+        for client in clients:
+            by_shard[shards[str(client[0])]].append(client)
+        for shard, shard_clients in by_shard.items():
+            async with self.acquire(shard=shard) as conn:
+                await self._upsert_plugin_clients(conn, shard_clients)
+
+    async def _upsert_plugin_clients(self, conn: asyncpg.Connection, clients: List[Tuple[str, str, datetime.datetime, int, int]]):
+        await conn.execute(
+            """
+            INSERT INTO plugin_clients AS c (vault_id, client_identifier, first_seen, last_seen, poll_count, claim_count,
+                                             window_start, window_polls, previous_window_polls)
+            SELECT t.vault_id, t.client_identifier, t.last_seen, t.last_seen, t.polls, t.claims,
+                   date_bin(make_interval(secs => $6), now(), timestamptz 'epoch'), t.polls, 0
+            FROM unnest($1::uuid[], $2::text[], $3::timestamptz[], $4::bigint[], $5::bigint[])
+                AS t(vault_id, client_identifier, last_seen, polls, claims)
+            JOIN vaults v ON v.id = t.vault_id AND v.deleted_at IS NULL
+            ON CONFLICT (vault_id, client_identifier) DO UPDATE SET
+                last_seen = GREATEST(c.last_seen, EXCLUDED.last_seen),
+                poll_count = c.poll_count + EXCLUDED.poll_count,
+                claim_count = c.claim_count + EXCLUDED.claim_count,
+                previous_window_polls = CASE
+                    WHEN c.window_start = EXCLUDED.window_start THEN c.previous_window_polls
+                    WHEN c.window_start = EXCLUDED.window_start - make_interval(secs => $6) THEN c.window_polls
+                    ELSE 0 END,
+                window_polls = CASE
+                    WHEN c.window_start = EXCLUDED.window_start THEN c.window_polls + EXCLUDED.window_polls
+                    ELSE EXCLUDED.window_polls END,
+                window_start = EXCLUDED.window_start
+            """,
+            [client[0] for client in clients],
+            [client[1] for client in clients],
+            [client[2] for client in clients],
+            [client[3] for client in clients],
+            [client[4] for client in clients],
+            CLIENT_POLL_WINDOW_SECONDS,
+        )
+
+    @instrumented
+    async def get_plugin_clients(self, vault_id: UUID, seen_within: float) -> List[PluginClient]:
+        """
+        Clients of the vault seen in the last `seen_within` seconds, most recent first.
+        The poll rate counts the current window fully and the previous one in proportion
+        to how much of it still lies within the last minute.
+        """
+        async with self.acquire_read(shard=await self.shard_of(vault_id)) as conn:
+            rows = await conn.fetch(
+                """
+                SELECT vault_id, client_identifier, first_seen, last_seen, poll_count, claim_count,
+                       CASE
+                           WHEN window_start = w.current THEN window_polls
+                               + previous_window_polls * (1 - extract(epoch FROM now() - w.current) / $3)
+                           WHEN window_start = w.current - make_interval(secs => $3) THEN window_polls
+                               * (1 - extract(epoch FROM now() - w.current) / $3)
+                           ELSE 0
+                       END * 60 / $3 AS polls_per_minute
+                FROM plugin_clients,
+                     LATERAL (SELECT date_bin(make_interval(secs => $3), now(), timestamptz 'epoch') AS current) w
+                WHERE vault_id = $1 AND last_seen > now() - make_interval(secs => $2)
+                ORDER BY last_seen DESC
+                """,
+                str(vault_id), seen_within, CLIENT_POLL_WINDOW_SECONDS
+            )
+            return [PluginClient(**row) for row in rows]
+
+    @instrumented
+    async def take_rate_limit_token(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take a token from the shared bucket `key`, refilled at `rate` per second up to `burst`.
+        Returns 0 when one was taken, otherwise the seconds until the next token is available.
+        """
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at, taken)
+                VALUES ($1, $3::float8 - 1, now(), true)
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = LEAST($3, b.tokens + GREATEST(extract(epoch FROM now() - b.updated_at)::float8, 0) * $2::float8)
+                        - CASE WHEN LEAST($3, b.tokens + GREATEST(extract(epoch FROM now() - b.updated_at)::float8, 0) * $2::float8) >= 1
+                               THEN 1 ELSE 0 END,
+                    taken = LEAST($3, b.tokens + GREATEST(extract(epoch FROM now() - b.updated_at)::float8, 0) * $2::float8) >= 1,
+                    updated_at = GREATEST(b.updated_at, now())
+                RETURNING tokens, taken
+                """,
+                key, float(rate), float(burst)
+            )
+        return 0.0 if row["taken"] else (1 - row["tokens"]) / rate
+
+    @instrumented
+    async def delete_idle_rate_limit_buckets(self, prefix: str, idle_seconds: float) -> int:
+        """
+        Delete the shared buckets whose key starts with `prefix` and that were not used for
+        `idle_seconds`. A bucket idle for burst/rate seconds is full again, so dropping it
+        changes no limit. Returns the number of buckets deleted.
+        """
+        async with self.acquire() as conn:
+            return await conn.fetchval(
+                """
+                WITH deleted AS (
+                    DELETE FROM rate_limit_buckets
+                    WHERE key LIKE $1 || '%' AND updated_at < now() - make_interval(secs => $2)
+                    RETURNING 1
+                )
+                SELECT count(*) FROM deleted
+                """,
+                prefix, float(idle_seconds)
+            )
+
+    @instrumented
+    async def search_notes(self, vault_id: UUID, query: str, state: Optional[str] = None, limit: int = 20,
+                           after: Optional[Tuple[float, datetime.datetime, UUID]] = None) -> List[NoteSearchResult]:
+        """
+        Full-text search in the vault's notes, best matches first, ordered by
+        (rank DESC, created_at, id). `after` is the (rank, created_at, id) of the last
+        result of the previous page. Matches are found through the GIN index on
+        (vault_id, search_vector); snippets are built only for the returned page.
+        """
+        if after is None:
+            after = (None, None, None)
+        async with self.acquire_read(vault_id) as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT {NOTE_SUMMARY_COLUMNS}, rank,
+                       ts_headline('simple', left(note_body(content, content_hash), {SEARCH_INDEXED_CONTENT_LENGTH}), q,
+                                   'StartSel=**, StopSel=**, MaxFragments=2, MaxWords=20, MinWords=5') AS snippet
+                FROM (
+                    SELECT * FROM (
+                        SELECT {NOTE_SUMMARY_COLUMNS}, content, content_hash, ts_rank(search_vector, q) AS rank
+                        FROM notes, websearch_to_tsquery('simple', $2) AS q
+                        WHERE vault_id = $1 AND search_vector @@ q
+                          AND ($3::note_state IS NULL OR state = $3::note_state)
+                    ) matches
+                    WHERE $4::real IS NULL OR rank < $4::real
+                       OR (rank = $4::real AND (created_at, id) > ($5::timestamptz, $6::uuid))
+                    ORDER BY rank DESC, created_at ASC, id ASC
+                    LIMIT $7
+                ) page, websearch_to_tsquery('simple', $2) AS q
+                ORDER BY rank DESC, created_at ASC, id ASC
+                """,
+                str(vault_id), query, state, after[0], after[1],
+                str(after[2]) if after[2] is not None else None, limit
+            )
+            return [NoteSearchResult(**row) for row in rows]
+
+    @instrumented
+    async def archive_delivered_notes(self, delivered_before: datetime.datetime, limit: int,
+                                      shard: str = MAIN_SHARD) -> int:
+        """
+        Move up to `limit` notes on `shard` delivered before the given time into notes_archive.
+        Rows locked by other transactions are skipped, so the batch never waits on the hot path.
+        Deduplicated bodies stay in note_contents; the archived row keeps the reference.
+        Vaults being moved away from the shard are left alone.
+        """
+        async with self.acquire(shard=shard) as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    """
+                    WITH moved AS (
+                        DELETE FROM notes
+                        WHERE id IN (
+                            SELECT id FROM notes
+                            WHERE state = 'DELIVERED' AND updated_at < $1
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM vault_versions v
+                                  WHERE v.vault_id = notes.vault_id AND v.moved_to IS NOT NULL
+                              )
+                            ORDER BY updated_at
+                            LIMIT $2
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, vault_id, external_id, title, content, content_hash, state, claim_owner, claim_timestamp, created_at, updated_at
+                    )
+                    INSERT INTO notes_archive (id, vault_id, external_id, title, content, content_hash, state, claim_owner, claim_timestamp, created_at, updated_at)
+                    SELECT id, vault_id, external_id, title, content, content_hash, state, claim_owner, claim_timestamp, created_at, updated_at
+                    FROM moved
+                    RETURNING vault_id
+                    """,
+                    delivered_before, limit
+                )
+                if not rows:
+                    return 0
+                archived = collections.Counter(str(row["vault_id"]) for row in rows)
+                await self._count_notes(conn, archived, "archived", source="delivered")
+                versions = await self._publish_note_events(conn, "notes_archived", [str(row["vault_id"]) for row in rows])
+        self._remember_versions(versions)
+        return len(rows)
+
+    @instrumented
+    async def release_expired_claims(self, claimed_before: datetime.datetime, limit: int, lock_key: int,
+                                     shard: str = MAIN_SHARD) -> Optional[List[asyncpg.Record]]:
+        """
+        Return up to `limit` notes on `shard` claimed before the given time to PENDING, so
+        another client can claim them. Runs under the transaction-level advisory lock
+        `lock_key`, which keeps concurrent reapers of other workers out (and works behind
+        PgBouncer in transaction mode); returns None when another worker holds it.
+        Otherwise returns the (id, vault_id, claim_owner) of the released notes.
+        """
+        async with self.acquire(shard=shard) as conn:
+            async with conn.transaction():
+                if not await conn.fetchval("SELECT pg_try_advisory_xact_lock($1)", lock_key):
+                    return None
+                rows = await conn.fetch(
+                    """
+                    WITH expired AS (
+                        SELECT id, claim_owner FROM notes
+                        WHERE state = 'CLAIMED' AND claim_timestamp < $1
+                          AND NOT EXISTS (
+                              SELECT 1 FROM vault_versions v
+                              WHERE v.vault_id = notes.vault_id AND v.moved_to IS NOT NULL
+                          )
+                        ORDER BY claim_timestamp
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE notes n
+                    SET state = 'PENDING', claim_owner = NULL, claim_timestamp = NULL, updated_at = NOW()
+                    FROM expired
+                    WHERE n.id = expired.id
+                    RETURNING n.id, n.vault_id, expired.claim_owner
+                    """,
+                    claimed_before, limit
+                )
+                if not rows:
+                    return []
+                released = collections.Counter(str(row["vault_id"]) for row in rows)
+                await self._count_notes(conn, released, "pending", source="claimed")
+                versions = await self._publish_note_events(conn, "claims_expired", list(released))
+        self._remember_versions(versions)
+        NOTE_CLAIMS_EXPIRED.inc(amount=len(rows))
+        return rows
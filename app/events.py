@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set
+from uuid import UUID
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+NOTE_EVENTS_CHANNEL = "note_events"
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+RECONNECT_DELAY_SECONDS = 1.0
+MAX_RECONNECT_DELAY_SECONDS = 30.0
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventListener:
+    """
+    Keeps a single LISTEN connection to Postgres and dispatches notifications
+    to in-process handlers, so every worker needs only one extra connection.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.conn: Optional[asyncpg.Connection] = None
+        self._handlers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._reconnect_handlers: List[Callable[[], None]] = []
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def add_handler(self, channel: str, handler: Callable[[str], None]):
+        self._handlers[channel].append(handler)
+
+    def add_reconnect_handler(self, handler: Callable[[], None]):
+        """
+        Called after the connection is re-established. Notifications sent while it
+        was down are lost, so handlers should drop any state that relies on them.
+        """
+        self._reconnect_handlers.append(handler)
+
+    @property
+    def connected(self) -> bool:
+        return self.conn is not None and not self.conn.is_closed()
+
+    async def start(self):
+        self._closing = False
+        await self._connect()
+
+    async def close(self):
+        self._closing = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self.conn and not self.conn.is_closed():
+            await self.conn.close()
+            logger.info("Event listener connection closed.")
+        self.conn = None
+
+    async def _connect(self):
+        self.conn = await asyncpg.connect(dsn=self.dsn)
+        self.conn.add_termination_listener(self._on_termination)
+        for channel in self._handlers:
+            await self.conn.add_listener(channel, self._dispatch)
+        logger.info("Listening for notifications on %s.", ", ".join(self._handlers) or "no channels")
+
+    def _on_termination(self, conn: asyncpg.Connection):
+        if self._closing:
+            return
+        logger.warning("Event listener connection lost, reconnecting.")
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = RECONNECT_DELAY_SECONDS
+        while not self._closing:
+            try:
+                await self._connect()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Event listener reconnect failed: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+                continue
+            for handler in self._reconnect_handlers:
+                handler()
+            return
+
+    def _dispatch(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Notification handler for %s failed.", channel)
+
+
+class VaultEvents:
+    """
+    In-process fan-out of note events to the clients waiting on a vault.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.closed = False
+
+    def publish(self, vault_id: str, event: Optional[dict]):
+        for queue in self._subscribers.get(vault_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow subscriber only needs to know that something changed.
+                pass
+
+    def handle_notification(self, payload: str):
+        event = json.loads(payload)
+        self.publish(event["vault_id"], event)
+
+    def close(self):
+        """
+        Wake up every subscriber with None so open streams can finish.
+        Later subscribers get None right away.
+        """
+        self.closed = True
+        for queues in self._subscribers.values():
+            for queue in queues:
+                try:
+                    queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    queue.get_nowait()
+                    queue.put_nowait(None)
+
+    @asynccontextmanager
+    async def subscribe(self, vault_id: UUID):
+        key = str(vault_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self.closed:
+            queue.put_nowait(None)
+        self._subscribers[key].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[key].discard(queue)
+            if not self._subscribers[key]:
+                del self._subscribers[key]
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+import logging
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ClientHeartbeats:
+    """
+    Tracks which plugin clients poll and claim notes of each vault. Requests only
+    update an in-memory entry per (vault, client); every `interval` seconds the
+    entries are written to plugin_clients in one bulk upsert, so a client polling
+    many times a second still costs one row write per interval. At most
+    `max_clients` distinct clients are tracked between flushes; others are dropped
+    until the next flush.
+    """
+
+    def __init__(self, db: Database, interval: float = 10.0, max_clients: int = 100000):
+        self.db = db
+        self.interval = interval
+        self.max_clients = max_clients
+        # (vault_id, client_id) -> [last_seen, polls, claims]
+        self.pending: Dict[Tuple[str, str], list] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.recorded_total = 0
+        self.written_total = 0
+        self.dropped_total = 0
+        self.errors_total = 0
+
+    def record_poll(self, vault_id: UUID, client_id: Optional[str]):
+        self._record(vault_id, client_id, polls=1, claims=0)
+
+    def record_claims(self, vault_id: UUID, client_id: str, count: int = 1):
+        self._record(vault_id, client_id, polls=0, claims=count)
+
+    def _record(self, vault_id: UUID, client_id: Optional[str], polls: int, claims: int):
+        if not client_id:
+            return
+        key = (str(vault_id), client_id)
+        entry = self.pending.get(key)
+        if entry is None:
+            if len(self.pending) >= self.max_clients:
+                self.dropped_total += 1
+                return
+            entry = self.pending[key] = [None, 0, 0]
+        entry[0] = datetime.datetime.now(datetime.timezone.utc)
+        entry[1] += polls
+        entry[2] += claims
+        self.recorded_total += 1
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, {}
+        clients: List[Tuple[str, str, datetime.datetime, int, int]] = [
+            (vault_id, client_id, last_seen, polls, claims)
+            for (vault_id, client_id), (last_seen, polls, claims) in pending.items()
+        ]
+        try:
+            await self.db.upsert_plugin_clients(clients)
+        except asyncio.CancelledError:
+            for key, (last_seen, polls, claims) in pending.items():
+                entry = self.pending.setdefault(key, [last_seen, 0, 0])
+                entry[0] = max(entry[0], last_seen)
+                entry[1] += polls
+                entry[2] += claims
+            raise
+        except Exception:
+            self.errors_total += 1
+            logger.exception("Failed to write heartbeats of %d clients.", len(clients))
+            return 0
+        self.written_total += len(clients)
+        return len(clients)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "pending_clients": len(self.pending),
+            "recorded_total": self.recorded_total,
+            "written_total": self.written_total,
+            "dropped_total": self.dropped_total,
+            "errors_total": self.errors_total,
+        }
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import signal
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class ShutdownCoordinator:
+    """
+    Tracks whether the worker should receive traffic and starts draining as soon
+    as it is asked to stop. Uvicorn waits for open requests before it runs the
+    lifespan shutdown, so event streams and long polls have to be ended at the
+    signal rather than in lifespan, or they would hold the worker for the whole
+    grace period.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.draining = False
+        self._drain_handlers: List[Callable[[], None]] = []
+
+    def add_drain_handler(self, handler: Callable[[], None]):
+        self._drain_handlers.append(handler)
+
+    def install_signal_handlers(self):
+        """
+        Chain onto the SIGTERM/SIGINT handlers the server installed, so draining
+        starts first and the server then shuts down as usual.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                loop.call_soon_threadsafe(self.drain)
+                previous(signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Not the main thread (e.g. an in-process test client); nothing to chain onto.
+                return
+
+    def drain(self):
+        if self.draining:
+            return
+        logger.info("Draining: no longer ready, closing event streams and long polls.")
+        self.draining = True
+        self.ready = False
+        for handler in self._drain_handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception("Drain handler failed.")
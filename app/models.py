@@ -38,4 +38,45 @@ class Note(BaseModel):
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
     updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
+class NoteSummary(BaseModel):
+    id: UUID
+    vault_id: UUID
+    external_id: Optional[str] = None
+    title: Optional[str] = None
+    state: NoteState
+    claim_owner: Optional[str] = None
+    claim_timestamp: Optional[datetime.datetime] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class NoteSearchResult(NoteSummary):
+    rank: float
+    # Matching fragments of the content with the matched words in **bold**.
+    snippet: str = ""
 
+class PluginClient(BaseModel):
+    vault_id: UUID
+    client_identifier: str
+    first_seen: datetime.datetime
+    last_seen: datetime.datetime
+    poll_count: int = 0
+    claim_count: int = 0
+    # Polls per minute over the last minute, estimated from the windowed counters.
+    polls_per_minute: float = 0.0
+
+class VaultDeletion(BaseModel):
+    vault_id: UUID
+    user_id: UUID
+    requested_at: datetime.datetime
+    rows_deleted: int = 0
+    finished_at: Optional[datetime.datetime] = None
+
+class VaultNoteStats(BaseModel):
+    vault_id: UUID
+    pending: int = 0
+    claimed: int = 0
+    delivered: int = 0
+    # Delivered notes moved to notes_archive by the retention worker.
+    archived: int = 0
+    updated_at: Optional[datetime.datetime] = None
+    reconciled_at: Optional[datetime.datetime] = None
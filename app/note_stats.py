@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import logging
+from typing import Optional
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock that keeps workers from recounting at the same time.
+NOTE_STATS_RECONCILE_LOCK_KEY = 0x6f657374617473
+
+
+class NoteStatsReconciler:
+    """
+    Background task that recounts the notes of every vault each `interval` seconds
+    and repairs vault_note_stats where the maintained counters drifted (after a
+    manual fix in the database, for example). Vaults are recounted one at a time,
+    `batch_pause` seconds apart, since each recount briefly holds up writes to that
+    vault. Every worker runs the task, but an advisory lock keeps them from recounting
+    at the same time, and vaults recounted less than `interval` / 2 ago are skipped,
+    so together the workers count each vault about once per interval.
+    """
+
+    def __init__(self, db: Database, interval: float = 3600.0, batch_size: int = 100, batch_pause: float = 0.05):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.task: Optional[asyncio.Task] = None
+        self.vaults_checked_total = 0
+        self.vaults_repaired_total = 0
+        self.vaults_skipped_total = 0
+        self.errors_total = 0
+        self.last_run_finished: Optional[datetime.datetime] = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Note stats reconciliation failed.")
+
+    async def run_once(self) -> int:
+        repaired = 0
+        after = None
+        while True:
+            vault_ids = await self.db.get_vault_ids(after, self.batch_size)
+            for vault_id in vault_ids:
+                drifted = await self.db.reconcile_note_stats(
+                    vault_id, NOTE_STATS_RECONCILE_LOCK_KEY, datetime.timedelta(seconds=self.interval / 2)
+                )
+                if drifted is None:
+                    # Recounted recently, or being recounted by another worker.
+                    self.vaults_skipped_total += 1
+                    continue
+                if drifted:
+                    repaired += 1
+                    self.vaults_repaired_total += 1
+                self.vaults_checked_total += 1
+                await asyncio.sleep(self.batch_pause)
+            if len(vault_ids) < self.batch_size:
+                break
+            after = vault_ids[-1]
+        self.last_run_finished = datetime.datetime.now(datetime.timezone.utc)
+        if repaired:
+            logger.info("Repaired note stats of %d vaults.", repaired)
+        return repaired
+
+    def stats(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "vaults_checked_total": self.vaults_checked_total,
+            "vaults_repaired_total": self.vaults_repaired_total,
+            "vaults_skipped_total": self.vaults_skipped_total,
+            "errors_total": self.errors_total,
+            "last_run_finished": self.last_run_finished,
+        }
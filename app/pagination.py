@@ -0,0 +1,35 @@
+import base64
+import binascii
+import datetime
+from typing import Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+
+
+def encode_cursor(created_at: datetime.datetime, note_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{note_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, note_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(created_at), UUID(note_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_search_cursor(rank: float, created_at: datetime.datetime, note_id: UUID) -> str:
+    raw = f"{rank!r}|{created_at.isoformat()}|{note_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, datetime.datetime, UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, created_at, note_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return float(rank), datetime.datetime.fromisoformat(created_at), UUID(note_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
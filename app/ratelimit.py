@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from starlette.datastructures import QueryParams
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.db import Database
+from app.metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_REJECTIONS = REGISTRY.register(Counter(
+    "rate_limit_rejections_total", "Requests rejected with 429 by a rate limit.", ("scope",),
+))
+ADMISSION_REJECTIONS = REGISTRY.register(Counter(
+    "admission_rejections_total", "Requests rejected with 503 because too many were in flight.",
+))
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets per key (a vault id, a user id or a client address), refilled at
+    `rate` tokens per second up to `burst`. Buckets live in this process. Buckets
+    unused for burst/rate seconds are full again and are dropped; beyond `max_keys`
+    the least recently used ones are forgotten, which only resets them to full.
+    """
+
+    def __init__(self, scope: str, rate: float, burst: float, max_keys: int = 100000):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def check(self, key: str):
+        """
+        Take a token for `key`, or raise 429 with the time until one is available.
+        """
+        retry_after = await self.take(key)
+        if retry_after > 0:
+            self.rejected += 1
+            RATE_LIMIT_REJECTIONS.inc(self.scope)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        self.allowed += 1
+
+    async def take(self, key: str) -> float:
+        """
+        Returns 0 when a token was taken, otherwise the seconds until the next one.
+        """
+        now = time.monotonic()
+        # Least recently used first; idle buckets have refilled and can go.
+        while self.buckets:
+            oldest, (_, oldest_updated) = next(iter(self.buckets.items()))
+            if now - oldest_updated < self.burst / self.rate:
+                break
+            del self.buckets[oldest]
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self.buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+class PostgresTokenBucketLimiter(TokenBucketLimiter):
+    """
+    Token buckets kept in the rate_limit_buckets table, so every worker shares
+    the same limit. Costs one short statement per request; if the database cannot
+    be reached the request is let through rather than failed. A background task
+    deletes the buckets of this scope that have been idle long enough to be full.
+    """
+
+    def __init__(self, db: Database, scope: str, rate: float, burst: float, cleanup_interval: float = 60.0):
+        super().__init__(scope, rate, burst, max_keys=0)
+        self.db = db
+        self.cleanup_interval = cleanup_interval
+        self.task: Optional[asyncio.Task] = None
+        self.errors = 0
+        self.deleted_idle = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                self.deleted_idle += await self.db.delete_idle_rate_limit_buckets(
+                    f"{self.scope}:", self.burst / self.rate
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                logger.exception("Deleting idle rate limit buckets failed.")
+
+    async def take(self, key: str) -> float:
+        try:
+            return await self.db.take_rate_limit_token(f"{self.scope}:{key}", self.rate, self.burst)
+        except Exception:
+            self.errors += 1
+            logger.exception("Rate limit check failed, allowing the request.")
+            return 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "deleted_idle": self.deleted_idle,
+        }
+
+
+class AdmissionControl:
+    """
+    Caps the number of API requests handled at once, so a burst queues in clients
+    instead of in front of the connection pool. Requests over the cap get 503 with
+    Retry-After. Event streams (`exempt_paths`) and long polls (GET on
+    `long_poll_paths` with `wait` > 0) mostly sit idle and are not counted.
+    """
+
+    def __init__(self, max_in_flight: int, retry_after: int = 1, prefix: str = "/api/",
+                 exempt_paths: Sequence[str] = (), long_poll_paths: Sequence[str] = ()):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self.exempt_paths = frozenset(exempt_paths)
+        self.long_poll_paths = frozenset(long_poll_paths)
+        self.in_flight = 0
+        self.rejected = 0
+
+    def applies_to(self, scope: Scope) -> bool:
+        path = scope["path"]
+        if self.max_in_flight <= 0 or not path.startswith(self.prefix) or path in self.exempt_paths:
+            return False
+        if scope["method"] == "GET" and path in self.long_poll_paths:
+            return QueryParams(scope.get("query_string", b"")).get("wait", "0") in ("", "0")
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "rejected": self.rejected}
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        control = self.control
+        if scope["type"] != "http" or not control.applies_to(scope):
+            await self.app(scope, receive, send)
+            return
+        if control.in_flight >= control.max_in_flight:
+            control.rejected += 1
+            ADMISSION_REJECTIONS.inc()
+            response = JSONResponse(
+                {"detail": "Server is busy"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(control.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        control.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.in_flight -= 1
@@ -0,0 +1,177 @@
+"""
+Move the data of a vault to another shard:
+
+    python -m app.rebalance VAULT_ID TARGET_SHARD
+
+The vault is fenced on its current shard first: from then on, note writes to it
+are answered with 503 until the move finishes. Its notes, archived notes, delivery
+logs, client records, note counts and change version are then copied to the target
+in one transaction, the vault_shards directory is pointed at the target, and the
+copies left on the old shard are deleted in batches. The old shard keeps the stub
+vault row and a fenced version row, so writes routed there by a stale cache are
+refused. A move interrupted at any step can be run again.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+from typing import Dict, List
+from uuid import UUID
+
+import asyncpg
+
+from app.db import Database, CONTENT_TABLES, VAULT_DATA_TABLES
+from app.shards import MAIN_SHARD, parse_shard_dsns
+from settings import get_postgres_dsn, get_pool_options, POSTGRES_SHARDS, VAULT_DELETION_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 1000
+# Columns that are not copied: delivery log ids come from the target's sequence, and
+# search vectors are recomputed once the deduplicated bodies are in place.
+SKIPPED_COLUMNS = {"delivery_logs": {"id"}, "notes": {"search_vector"}}
+
+
+async def table_columns(conn: asyncpg.Connection, table: str) -> List[str]:
+    rows = await conn.fetch(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = $1
+        ORDER BY ordinal_position
+        """,
+        table
+    )
+    return [row["column_name"] for row in rows if row["column_name"] not in SKIPPED_COLUMNS.get(table, ())]
+
+
+async def clear_vault(db: Database, conn: asyncpg.Connection, vault_id: UUID):
+    """
+    Delete the vault's data on the shard of `conn`, one transaction per batch, keeping
+    the vault and version rows.
+    """
+    while True:
+        async with conn.transaction():
+            if not await db.delete_vault_rows(conn, vault_id, VAULT_DELETION_BATCH_SIZE):
+                break
+    await conn.execute("DELETE FROM vault_note_stats WHERE vault_id = $1", str(vault_id))
+
+
+async def copy_table(source: asyncpg.Connection, target: asyncpg.Connection, table: str, vault_id: UUID,
+                     refs: collections.Counter) -> int:
+    columns = await table_columns(source, table)
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE vault_id = $1"
+    content_hash = columns.index("content_hash") if table in CONTENT_TABLES else None
+    copied = 0
+    batch = []
+    async for record in source.cursor(query, str(vault_id), prefetch=COPY_BATCH_SIZE):
+        batch.append(tuple(record))
+        if content_hash is not None and record[content_hash] is not None:
+            refs[record[content_hash]] += 1
+        if len(batch) == COPY_BATCH_SIZE:
+            await target.copy_records_to_table(table, records=batch, columns=columns)
+            copied += len(batch)
+            batch = []
+    if batch:
+        await target.copy_records_to_table(table, records=batch, columns=columns)
+        copied += len(batch)
+    return copied
+
+
+async def copy_contents(source: asyncpg.Connection, target: asyncpg.Connection, refs: Dict[bytes, int]):
+    """
+    Add the references of the copied notes to the bodies on the target, copying bodies it does not have.
+    """
+    content_hashes = sorted(refs)
+    for start in range(0, len(content_hashes), COPY_BATCH_SIZE):
+        chunk = content_hashes[start:start + COPY_BATCH_SIZE]
+        rows = await source.fetch(
+            "SELECT hash, content, size FROM note_contents WHERE hash = ANY($1::bytea[]) ORDER BY hash", chunk
+        )
+        await target.execute(
+            """
+            INSERT INTO note_contents (hash, content, size, refcount)
+            SELECT * FROM unnest($1::bytea[], $2::text[], $3::bigint[], $4::bigint[])
+            ON CONFLICT (hash) DO UPDATE SET refcount = note_contents.refcount + EXCLUDED.refcount
+            """,
+            [row["hash"] for row in rows], [row["content"] for row in rows],
+            [row["size"] for row in rows], [refs[row["hash"]] for row in rows]
+        )
+
+
+async def move_vault(db: Database, vault_id: UUID, target: str) -> int:
+    """
+    Move the vault's data to the `target` shard. Returns the number of rows copied.
+    """
+    if target not in db.shard_names:
+        raise ValueError(f"Unknown shard {target!r}")
+    async with db.acquire() as conn:
+        if not await conn.fetchval("SELECT 1 FROM vaults WHERE id = $1 AND deleted_at IS NULL", str(vault_id)):
+            raise ValueError(f"Vault {vault_id} not found")
+        source = await conn.fetchval(
+            """
+            INSERT INTO vault_shards (vault_id, shard, moving_to) VALUES ($1, $2, $3)
+            ON CONFLICT (vault_id) DO UPDATE SET moving_to = EXCLUDED.moving_to, updated_at = NOW()
+            RETURNING shard
+            """,
+            str(vault_id), MAIN_SHARD, target
+        )
+    if source == target:
+        async with db.acquire() as conn:
+            await conn.execute("UPDATE vault_shards SET moving_to = NULL WHERE vault_id = $1", str(vault_id))
+        return 0
+
+    async with db.acquire(shard=source) as conn:
+        # Waits for note writes in flight; the ones that have not bumped the version yet are refused.
+        await conn.execute(
+            """
+            INSERT INTO vault_versions (vault_id, version, moved_to) VALUES ($1, 0, $2)
+            ON CONFLICT (vault_id) DO UPDATE SET moved_to = EXCLUDED.moved_to
+            """,
+            str(vault_id), target
+        )
+    logger.info("Vault %s fenced on shard %s.", vault_id, source)
+
+    copied = 0
+    async with db.acquire(shard=source) as source_conn, db.acquire(shard=target) as target_conn:
+        async with source_conn.transaction(isolation="repeatable_read", readonly=True), target_conn.transaction():
+            if target != MAIN_SHARD:
+                await db.create_vault_stub(target_conn, vault_id)
+            # Leftovers of an earlier move away from the target.
+            await clear_vault(db, target_conn, vault_id)
+            await target_conn.execute("DELETE FROM vault_versions WHERE vault_id = $1", str(vault_id))
+            refs = collections.Counter()
+            for table in (*VAULT_DATA_TABLES, "vault_note_stats", "vault_versions"):
+                copied += await copy_table(source_conn, target_conn, table, vault_id, refs)
+            await copy_contents(source_conn, target_conn, refs)
+            await target_conn.execute("UPDATE vault_versions SET moved_to = NULL WHERE vault_id = $1", str(vault_id))
+            await target_conn.execute(
+                "UPDATE notes SET search_vector = note_search_vector(title, note_body(content, content_hash)) WHERE vault_id = $1",
+                str(vault_id)
+            )
+    logger.info("Copied %d rows of vault %s to shard %s.", copied, vault_id, target)
+
+    await db.set_vault_shard(vault_id, target)
+
+    async with db.acquire(shard=source) as conn:
+        await clear_vault(db, conn, vault_id)
+    logger.info("Moved vault %s from shard %s to %s.", vault_id, source, target)
+    return copied
+
+
+async def main(vault_id: UUID, target: str):
+    options = {**get_pool_options(), "min_size": 1, "max_size": 2}
+    db = Database(dsn=get_postgres_dsn(), pool_options=options, shard_dsns=parse_shard_dsns(POSTGRES_SHARDS))
+    await db.connect()
+    try:
+        await move_vault(db, vault_id, target)
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("vault_id", type=UUID)
+    parser.add_argument("target_shard")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.vault_id, args.target_shard))
@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Optional
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionWorker:
+    """
+    Background task that moves DELIVERED notes older than `retention` out of the
+    hot notes table into notes_archive. Work is done in small batches with a pause
+    in between, so each transaction holds its row locks only briefly. Shards are
+    processed one after another.
+    """
+
+    def __init__(self, db: Database, retention: datetime.timedelta, batch_size: int = 500,
+                 interval: float = 300.0, batch_pause: float = 0.1):
+        self.db = db
+        self.retention = retention
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batch_pause = batch_pause
+        self.task: Optional[asyncio.Task] = None
+        self.archived_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.last_run_started: Optional[datetime.datetime] = None
+        self.last_run_finished: Optional[datetime.datetime] = None
+        self.last_run_archived = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Retention run failed.")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        self.last_run_started = datetime.datetime.now(datetime.timezone.utc)
+        self.last_run_archived = 0
+        delivered_before = self.last_run_started - self.retention
+        for shard in self.db.shard_names:
+            while True:
+                started = time.perf_counter()
+                archived = await self.db.archive_delivered_notes(delivered_before, self.batch_size, shard)
+                self.last_batch_seconds = time.perf_counter() - started
+                self.batches_total += 1
+                self.archived_total += archived
+                self.last_run_archived += archived
+                if archived < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+        self.last_run_finished = datetime.datetime.now(datetime.timezone.utc)
+        if self.last_run_archived:
+            logger.info("Archived %d delivered notes.", self.last_run_archived)
+        return self.last_run_archived
+
+    def stats(self) -> dict:
+        return {
+            "retention_seconds": self.retention.total_seconds(),
+            "running": self.task is not None,
+            "archived_total": self.archived_total,
+            "batches_total": self.batches_total,
+            "errors_total": self.errors_total,
+            "last_run_started": self.last_run_started,
+            "last_run_finished": self.last_run_finished,
+            "last_run_archived": self.last_run_archived,
+            "last_batch_seconds": self.last_batch_seconds,
+        }
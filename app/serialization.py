@@ -0,0 +1,59 @@
+import datetime
+import json
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Mapping, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns that asyncpg returns as its own UUID type, which orjson does not serialize.
+UUID_COLUMNS = frozenset({"id", "vault_id", "user_id"})
+
+
+@lru_cache(maxsize=32)
+def compile_row_encoder(columns: Tuple[str, ...]) -> Callable[[Mapping[str, Any]], dict]:
+    """
+    Build a converter from a DB row with the given columns to a JSON-ready dict.
+    The per-column work is decided once per column set instead of once per value.
+    """
+    plan = tuple((column, str if column in UUID_COLUMNS else None) for column in columns)
+
+    def encode(row: Mapping[str, Any]) -> dict:
+        result = {}
+        for column, convert in plan:
+            value = row[column]
+            result[column] = convert(value) if convert is not None and value is not None else value
+        return result
+
+    return encode
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat().replace("+00:00", "Z")
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def encode_rows(rows: Iterable[Mapping[str, Any]]) -> bytes:
+    """
+    Encode DB rows (asyncpg Records) straight to a JSON array, skipping model validation.
+    """
+    rows = list(rows)
+    if not rows:
+        return b"[]"
+    encode = compile_row_encoder(tuple(rows[0].keys()))
+    return dumps([encode(row) for row in rows])
+
+
+def encode_row(row: Optional[Mapping[str, Any]]) -> bytes:
+    if row is None:
+        return b"null"
+    return dumps(compile_row_encoder(tuple(row.keys()))(row))
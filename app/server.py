@@ -1,20 +1,136 @@
+import asyncio
+import hashlib
+import hmac
+import json
 import os
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Depends, HTTPException, status, Header, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, status, Header, Query, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Any, AsyncIterator, Optional, List, Tuple, Union
 from uuid import UUID, uuid4
-from datetime import datetime
-from app.security import hash_password, verify_password, create_access_token, decode_access_token
+from datetime import datetime, timedelta
+from app.security import hashing_pool, hash_password_async, verify_password_async, create_access_token, decode_access_token
 
-from app.models import User, Vault, Note, NoteState
+from app.models import User, Vault, VaultDeletion, Note, NoteState
 from app.db import Database
-from settings import get_postgres_dsn
+from app.cache import MISSING
+from app.metrics import REGISTRY, Gauge, MetricsMiddleware
+from app.compression import RequestDecompressionMiddleware, ResponseCompressionMiddleware
+from app.pagination import encode_cursor, decode_cursor, encode_search_cursor, decode_search_cursor
+from app.serialization import encode_rows, encode_row
+from app.retention import RetentionWorker
+from app.claim_reaper import ClaimReaper
+from app.vault_deletion import VaultDeletionWorker
+from app.note_stats import NoteStatsReconciler
+from app.audit import DeliveryLogger
+from app.heartbeats import ClientHeartbeats
+from app.lifecycle import ShutdownCoordinator
+from app.ratelimit import TokenBucketLimiter, PostgresTokenBucketLimiter, AdmissionControl, AdmissionMiddleware
+from app.events import EventListener, VaultEvents, NOTE_EVENTS_CHANNEL, CACHE_INVALIDATION_CHANNEL
+from app.shards import VaultMovedError, parse_shard_dsns
+from settings import (
+    get_postgres_dsn, get_listen_dsn, get_pool_options, POSTGRES_REPLICA_DSN, POSTGRES_REPLICA_LAG_WINDOW_SECONDS,
+    POSTGRES_SHARDS, SHARD_PLACEMENT, SHARD_MOVE_RETRY_AFTER_SECONDS,
+    NOTES_LONG_POLL_MAX_SECONDS, NOTES_STREAM_KEEPALIVE_SECONDS, NOTES_BATCH_MAX_ITEMS, NOTES_BATCH_MAX_BYTES,
+    AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS, AUTH_NEGATIVE_CACHE_TTL_SECONDS,
+    NOTE_CONTENT_DEDUP_MIN_SIZE, NOTE_CONTENT_CACHE_SIZE, NOTE_CONTENT_CACHE_MAX_ITEM_SIZE,
+    FAST_JSON_RESPONSES, NOTE_DOWNLOAD_STREAM_THRESHOLD, NOTE_DOWNLOAD_CHUNK_SIZE, REQUEST_MAX_DECOMPRESSED_SIZE, RESPONSE_COMPRESSION_MIN_SIZE,
+    RETENTION_ENABLED, RETENTION_DAYS, RETENTION_BATCH_SIZE, RETENTION_INTERVAL_SECONDS, RETENTION_BATCH_PAUSE_SECONDS,
+    DELIVERY_LOG_ENABLED, DELIVERY_LOG_MAX_BUFFERED, DELIVERY_LOG_BATCH_SIZE, DELIVERY_LOG_FLUSH_INTERVAL_SECONDS,
+    CLIENT_HEARTBEAT_INTERVAL_SECONDS, CLIENT_HEARTBEAT_MAX_CLIENTS, CLIENT_ACTIVE_SECONDS,
+    RATE_LIMIT_BACKEND, VAULT_RATE_LIMIT_PER_SECOND, VAULT_RATE_LIMIT_BURST, USER_RATE_LIMIT_PER_SECOND, USER_RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_KEYS, MAX_IN_FLIGHT_REQUESTS, ADMISSION_RETRY_AFTER_SECONDS,
+    VAULT_DELETION_BATCH_SIZE, VAULT_DELETION_BATCH_PAUSE_SECONDS, VAULT_DELETION_INTERVAL_SECONDS,
+    CLAIM_LEASE_SECONDS, CLAIM_REAPER_ENABLED, CLAIM_REAPER_INTERVAL_SECONDS, CLAIM_REAPER_BATCH_SIZE,
+    CLAIM_REAPER_BATCH_PAUSE_SECONDS,
+    NOTE_STATS_RECONCILE_ENABLED, NOTE_STATS_RECONCILE_INTERVAL_SECONDS, NOTE_STATS_RECONCILE_BATCH_SIZE,
+    NOTE_STATS_RECONCILE_PAUSE_SECONDS, INTERNAL_API_TOKEN,
+)
 
-db = Database(dsn=get_postgres_dsn())
+db = Database(
+    dsn=get_postgres_dsn(),
+    cache_size=AUTH_CACHE_SIZE,
+    cache_ttl=AUTH_CACHE_TTL_SECONDS,
+    negative_cache_ttl=AUTH_NEGATIVE_CACHE_TTL_SECONDS,
+    pool_options=get_pool_options(),
+    replica_dsn=POSTGRES_REPLICA_DSN,
+    replica_lag_window=POSTGRES_REPLICA_LAG_WINDOW_SECONDS,
+    content_dedup_min_size=NOTE_CONTENT_DEDUP_MIN_SIZE,
+    content_cache_size=NOTE_CONTENT_CACHE_SIZE,
+    content_cache_max_item_size=NOTE_CONTENT_CACHE_MAX_ITEM_SIZE,
+    shard_dsns=parse_shard_dsns(POSTGRES_SHARDS),
+    shard_placement=SHARD_PLACEMENT,
+)
+event_listener = EventListener(dsn=get_listen_dsn())
+vault_events = VaultEvents()
+event_listener.add_handler(NOTE_EVENTS_CHANNEL, db.handle_note_event)
+event_listener.add_handler(NOTE_EVENTS_CHANNEL, vault_events.handle_notification)
+event_listener.add_handler(CACHE_INVALIDATION_CHANNEL, db.handle_cache_invalidation)
+event_listener.add_reconnect_handler(db.clear_caches)
+# Note events of vaults on other shards are sent by those shards.
+shard_event_listeners = [EventListener(dsn=dsn) for dsn in db.shard_dsns.values()]
+for shard_listener in shard_event_listeners:
+    shard_listener.add_handler(NOTE_EVENTS_CHANNEL, db.handle_note_event)
+    shard_listener.add_handler(NOTE_EVENTS_CHANNEL, vault_events.handle_notification)
+    shard_listener.add_reconnect_handler(db.clear_caches)
+retention_worker = RetentionWorker(
+    db,
+    retention=timedelta(days=RETENTION_DAYS),
+    batch_size=RETENTION_BATCH_SIZE,
+    interval=RETENTION_INTERVAL_SECONDS,
+    batch_pause=RETENTION_BATCH_PAUSE_SECONDS,
+)
+vault_deletion_worker = VaultDeletionWorker(
+    db,
+    batch_size=VAULT_DELETION_BATCH_SIZE,
+    batch_pause=VAULT_DELETION_BATCH_PAUSE_SECONDS,
+    interval=VAULT_DELETION_INTERVAL_SECONDS,
+)
+note_stats_reconciler = NoteStatsReconciler(
+    db,
+    interval=NOTE_STATS_RECONCILE_INTERVAL_SECONDS,
+    batch_size=NOTE_STATS_RECONCILE_BATCH_SIZE,
+    batch_pause=NOTE_STATS_RECONCILE_PAUSE_SECONDS,
+)
+delivery_logger = DeliveryLogger(
+    db,
+    max_buffered=DELIVERY_LOG_MAX_BUFFERED if DELIVERY_LOG_ENABLED else 0,
+    batch_size=DELIVERY_LOG_BATCH_SIZE,
+    flush_interval=DELIVERY_LOG_FLUSH_INTERVAL_SECONDS,
+)
+claim_reaper = ClaimReaper(
+    db,
+    delivery_logger,
+    lease=timedelta(seconds=CLAIM_LEASE_SECONDS),
+    batch_size=CLAIM_REAPER_BATCH_SIZE,
+    interval=CLAIM_REAPER_INTERVAL_SECONDS,
+    batch_pause=CLAIM_REAPER_BATCH_PAUSE_SECONDS,
+)
+client_heartbeats = ClientHeartbeats(
+    db,
+    interval=CLIENT_HEARTBEAT_INTERVAL_SECONDS,
+    max_clients=CLIENT_HEARTBEAT_MAX_CLIENTS,
+)
+def make_rate_limiter(scope: str, rate: float, burst: float) -> Optional[TokenBucketLimiter]:
+    if RATE_LIMIT_BACKEND == "off":
+         return None
+    if RATE_LIMIT_BACKEND == "postgres":
+         return PostgresTokenBucketLimiter(db, scope, rate, burst)
+    return TokenBucketLimiter(scope, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS)
+
+vault_rate_limiter = make_rate_limiter("vault", VAULT_RATE_LIMIT_PER_SECOND, VAULT_RATE_LIMIT_BURST)
+user_rate_limiter = make_rate_limiter("user", USER_RATE_LIMIT_PER_SECOND, USER_RATE_LIMIT_BURST)
+admission_control = AdmissionControl(
+    max_in_flight=MAX_IN_FLIGHT_REQUESTS,
+    retry_after=ADMISSION_RETRY_AFTER_SECONDS,
+    exempt_paths=["/api/notes/stream"],
+    long_poll_paths=["/api/notes"],
+)
+shutdown = ShutdownCoordinator()
+shutdown.add_drain_handler(vault_events.close)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
 
@@ -45,6 +161,29 @@ class VaultResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class VaultDeletionResponse(BaseModel):
+    vault_id: UUID
+    status: str
+    requested_at: datetime
+    rows_deleted: int
+    finished_at: Optional[datetime] = None
+
+class VaultNoteStatsResponse(BaseModel):
+    pending: int
+    claimed: int
+    delivered: int
+    archived: int
+    updated_at: Optional[datetime] = None
+
+class VaultWithStatsResponse(VaultResponse):
+    note_stats: VaultNoteStatsResponse
+
+def vault_deletion_response(deletion: VaultDeletion) -> VaultDeletionResponse:
+    return VaultDeletionResponse(
+         status="deleted" if deletion.finished_at else "deleting",
+         **deletion.model_dump(exclude={"user_id"}),
+    )
+
 class NoteCreate(BaseModel):
     external_id: Optional[str] = None
     title: str
@@ -62,48 +201,201 @@ class NoteResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class NoteSummaryResponse(BaseModel):
+    id: UUID
+    vault_id: UUID
+    external_id: Optional[str] = None
+    title: Optional[str] = None
+    state: str
+    claim_owner: Optional[str] = None
+    claim_timestamp: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+class PluginClientResponse(BaseModel):
+    client_id: str
+    first_seen: datetime
+    last_seen: datetime
+    poll_count: int
+    claim_count: int
+    polls_per_minute: float
+
+class NoteSearchResponse(NoteSummaryResponse):
+    rank: float
+    snippet: str
+
+class NoteBatchItemResult(BaseModel):
+    index: int
+    status: str
+    id: Optional[UUID] = None
+    external_id: Optional[str] = None
+    error: Optional[str] = None
+
+class ClaimBatchRequest(BaseModel):
+    client_id: str = Field(..., min_length=1)
+    limit: int = Field(10, ge=1, le=100)
+
+class ConfirmRequest(BaseModel):
+    # The client that claimed the note; another client's claim is never confirmed.
+    client_id: str = Field(..., min_length=1)
+
+class ConfirmBatchRequest(BaseModel):
+    note_ids: List[UUID] = Field(..., max_length=100)
+    client_id: str = Field(..., min_length=1)
+
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     token_data = decode_access_token(token)
     user_id: str = token_data.sub
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    if user_rate_limiter is not None:
+        await user_rate_limiter.check(user_id)
     user = await db.get_user_by_id(UUID(user_id))
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
 
-async def get_current_vault(authorization: str = Header(...)) -> Vault:
+async def require_internal_token(authorization: Optional[str] = Header(None)):
+    """
+    Guards the operational endpoints, which expose internal counters: only requests
+    carrying INTERNAL_API_TOKEN as a bearer token get through.
+    """
+    if INTERNAL_API_TOKEN is None:
+         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="INTERNAL_API_TOKEN is not configured")
+    if not authorization or not hmac.compare_digest(authorization.encode(), f"Bearer {INTERNAL_API_TOKEN}".encode()):
+         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid internal token",
+                             headers={"WWW-Authenticate": "Bearer"})
+
+async def get_current_vault(request: Request, authorization: str = Header(...)) -> Vault:
     if not authorization.startswith("Bearer "):
          raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token header")
     token = authorization[len("Bearer "):].strip()
-    vault = await db.get_vault_by_token(token)
+    client_key = f"ip:{request.client.host if request.client else 'unknown'}"
+    vault = db.get_cached_vault_by_token(token)
+    if vault is MISSING:
+         # Tokens that need a database lookup, and unknown tokens, count against the client
+         # address first, so made-up tokens cannot keep the pool busy or open buckets of their own.
+         if vault_rate_limiter is not None:
+              await vault_rate_limiter.check(client_key)
+         vault = await db.get_vault_by_token(token, use_cache=False)
+    elif vault is None and vault_rate_limiter is not None:
+         await vault_rate_limiter.check(client_key)
     if vault is None:
          raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid vault token")
+    if vault_rate_limiter is not None:
+         await vault_rate_limiter.check(str(vault.id))
     return vault
 
-async def get_user_by_username(username: str) -> Optional[User]:
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM users WHERE username = $1", username)
-        if row:
-             return User(**row)
-    return None
+async def fetch_notes(vault_id: UUID, state: Optional[str], limit: int, offset: int,
+                      after: Optional[Tuple[datetime, UUID]] = None, summary: bool = False) -> List[Note]:
+    if state is None:
+         return await db.get_notes_by_vault(vault_id, limit, offset, after, summary, FAST_JSON_RESPONSES)
+    return await db.get_notes_by_state(vault_id, state.upper(), limit, offset, after, summary, FAST_JSON_RESPONSES)
+
+def make_etag(version: int, *query: Any) -> str:
+    """
+    Weak ETag of a listing: the vault's change version plus a short hash of the query,
+    so a tag saved for one page or filter never matches another.
+    """
+    digest = hashlib.sha256(json.dumps(query).encode()).hexdigest()[:12]
+    return f'W/"{version}-{digest}"'
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    hashing_pool.start()
     await db.connect()
+    await db.warm_up()
+    await event_listener.start()
+    for shard_listener in shard_event_listeners:
+         await shard_listener.start()
+    if RETENTION_ENABLED:
+         retention_worker.start()
+    if DELIVERY_LOG_ENABLED:
+         delivery_logger.start()
+    client_heartbeats.start()
+    vault_deletion_worker.start()
+    if NOTE_STATS_RECONCILE_ENABLED:
+         note_stats_reconciler.start()
+    if CLAIM_REAPER_ENABLED:
+         claim_reaper.start()
+    for rate_limiter in (vault_rate_limiter, user_rate_limiter):
+         if rate_limiter is not None:
+              rate_limiter.start()
+    shutdown.install_signal_handlers()
+    shutdown.ready = True
     yield
+    # Normally already done at SIGTERM, before the server waited for open requests.
+    shutdown.drain()
+    await retention_worker.stop()
+    await vault_deletion_worker.stop()
+    await note_stats_reconciler.stop()
+    await claim_reaper.stop()
+    for rate_limiter in (vault_rate_limiter, user_rate_limiter):
+         if rate_limiter is not None:
+              await rate_limiter.stop()
+    await delivery_logger.stop()
+    await client_heartbeats.stop()
+    await event_listener.close()
+    for shard_listener in shard_event_listeners:
+         await shard_listener.close()
     await db.close()
+    hashing_pool.shutdown()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestDecompressionMiddleware, max_size=REQUEST_MAX_DECOMPRESSED_SIZE)
+app.add_middleware(ResponseCompressionMiddleware, minimum_size=RESPONSE_COMPRESSION_MIN_SIZE)
+app.add_middleware(AdmissionMiddleware, control=admission_control)
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(VaultMovedError)
+async def vault_moved_handler(request: Request, exc: VaultMovedError):
+    return JSONResponse(
+        {"detail": "Vault is being moved to another shard, retry shortly"},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(SHARD_MOVE_RETRY_AFTER_SECONDS)},
+    )
+
+def collect_stats(stats: dict, keys: List[str]) -> dict:
+    return {(name, key): values[key] for name, values in stats.items() for key in keys}
+
+REGISTRY.register(Gauge(
+    "db_pool_connections", "Connections of each database pool by state.", ("pool", "state"),
+    callback=lambda: collect_stats(db.pool_stats(), ["size", "idle", "max_size", "waiters"]),
+))
+REGISTRY.register(Gauge(
+    "cache_events", "Entries and lookup counters of the in-process caches.", ("cache", "counter"),
+    callback=lambda: collect_stats(db.cache_stats(), ["size", "hits", "misses", "evictions"]),
+))
+def register_stats_gauge(name: str, documentation: str, source) -> None:
+    """
+    Export the numeric entries of `source.stats()` as a gauge labelled by counter name.
+    """
+    REGISTRY.register(Gauge(
+        name, documentation, ("counter",),
+        callback=lambda: {(key,): value for key, value in source.stats().items()
+                          if isinstance(value, (int, float)) and not isinstance(value, bool)},
+    ))
+
+register_stats_gauge("password_hashing", "Password hashing pool queue and counters.", hashing_pool)
+register_stats_gauge("delivery_log", "Buffered delivery audit events and write counters.", delivery_logger)
+register_stats_gauge("client_heartbeats", "Plugin client heartbeats waiting to be written and write counters.",
+                     client_heartbeats)
+register_stats_gauge("admission", "API requests in flight and the limit.", admission_control)
+register_stats_gauge("vault_deletion", "Progress counters of background vault deletion.", vault_deletion_worker)
+register_stats_gauge("note_stats_reconciliation", "Vaults whose note counts were recounted and repaired.",
+                     note_stats_reconciler)
+register_stats_gauge("claim_reaper", "Expired note claims returned to PENDING.", claim_reaper)
+register_stats_gauge("retention", "Retention worker progress.", retention_worker)
 
 @app.post("/api/register", response_model=UserResponse, status_code=201)
 async def register(user_data: UserRegister):
+    password_hash = await hash_password_async(user_data.password)
     new_user = User(
          id=uuid4(),
          username=user_data.username,
          email=user_data.email,
-         password_hash=hash_password(user_data.password),
+         password_hash=password_hash,
          created_at=datetime.utcnow(),
          updated_at=datetime.utcnow()
     )
@@ -112,8 +404,8 @@ async def register(user_data: UserRegister):
 
 @app.post("/api/login", response_model=TokenResponse)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await get_user_by_username(form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+    user = await db.get_user_by_username(form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
          raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     access_token = create_access_token(str(user.id))
     return TokenResponse(access_token=access_token)
@@ -122,10 +414,14 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
-@app.get("/api/vaults", response_model=List[VaultResponse])
+@app.get("/api/vaults", response_model=List[VaultWithStatsResponse])
 async def list_vaults(current_user: User = Depends(get_current_user)):
     vaults = await db.get_vaults_by_user(current_user.id)
-    return vaults
+    note_stats = await db.get_note_stats([vault.id for vault in vaults])
+    return [
+         VaultWithStatsResponse(**vault.model_dump(), note_stats=note_stats[vault.id].model_dump())
+         for vault in vaults
+    ]
 
 @app.post("/api/vaults", response_model=VaultResponse, status_code=201)
 async def create_vault_endpoint(vault_data: VaultCreate, current_user: User = Depends(get_current_user)):
@@ -154,15 +450,46 @@ async def update_vault(vault_id: UUID, vault_data: VaultCreate, current_user: Us
          raise HTTPException(status_code=404, detail="Vault not found or not owned by user")
     return vault
 
-@app.delete("/api/vaults/{vault_id}", status_code=204)
+@app.delete("/api/vaults/{vault_id}", response_model=VaultDeletionResponse, status_code=202)
 async def delete_vault(vault_id: UUID, current_user: User = Depends(get_current_user)):
-    deleted = await db.delete_vault(vault_id, current_user.id)
-    if not deleted:
+    deletion = await db.delete_vault(vault_id, current_user.id)
+    if not deletion:
          raise HTTPException(status_code=404, detail="Vault not found or not owned by user")
-    return
+    vault_deletion_worker.wake()
+    return vault_deletion_response(deletion)
+
+@app.get("/api/vaults/{vault_id}/deletion", response_model=VaultDeletionResponse)
+async def get_vault_deletion(vault_id: UUID, current_user: User = Depends(get_current_user)):
+    deletion = await db.get_vault_deletion(vault_id, current_user.id)
+    if not deletion:
+         raise HTTPException(status_code=404, detail="No deletion of this vault")
+    return vault_deletion_response(deletion)
+
+@app.get("/api/vaults/{vault_id}/stats", response_model=VaultNoteStatsResponse)
+async def get_vault_note_stats(vault_id: UUID, current_user: User = Depends(get_current_user)):
+    vault = await db.get_user_vault(vault_id, current_user.id)
+    if not vault:
+         raise HTTPException(status_code=404, detail="Vault not found")
+    note_stats = await db.get_note_stats([vault.id])
+    return note_stats[vault.id]
+
+@app.get("/api/vaults/{vault_id}/clients", response_model=List[PluginClientResponse])
+async def list_vault_clients(
+    vault_id: UUID,
+    active_within: int = Query(CLIENT_ACTIVE_SECONDS, ge=1, le=30 * 24 * 3600),
+    current_user: User = Depends(get_current_user),
+):
+    vault = await db.get_user_vault(vault_id, current_user.id)
+    if not vault:
+         raise HTTPException(status_code=404, detail="Vault not found")
+    clients = await db.get_plugin_clients(vault.id, active_within)
+    return [
+         PluginClientResponse(client_id=client.client_identifier, **client.model_dump(exclude={"vault_id", "client_identifier"}))
+         for client in clients
+    ]
 
 @app.post("/api/notes", response_model=NoteResponse, status_code=201)
-async def create_note_endpoint(note_data: NoteCreate, current_vault: Vault = Depends(get_current_vault)):
+async def create_note_endpoint(note_data: NoteCreate, response: Response, current_vault: Vault = Depends(get_current_vault)):
     new_note = Note(
          id=uuid4(),
          vault_id=current_vault.id,
@@ -176,16 +503,209 @@ async def create_note_endpoint(note_data: NoteCreate, current_vault: Vault = Dep
          updated_at=datetime.utcnow()
     )
     created_note = await db.create_note(new_note)
+    if created_note.id != new_note.id:
+         # A retry with a known external_id returns the original note.
+         response.status_code = status.HTTP_200_OK
+    else:
+         delivery_logger.record("created", created_note.id, current_vault.id, external_id=created_note.external_id)
     return created_note
 
-@app.get("/api/notes", response_model=List[NoteResponse])
-async def list_notes(state: Optional[str] = None, limit: int = 10, offset: int = 0, current_vault: Vault = Depends(get_current_vault)):
-    if state is None:
-         notes = await db.get_notes_by_vault(current_vault.id, limit, offset)
-         return notes
-    else:
-         notes = await db.get_notes_by_state(current_vault.id, state.upper(), limit, offset)
-         return notes
+async def read_batch_items(request: Request) -> List[Any]:
+    """
+    Read the body of a batch request: a JSON array, or NDJSON (one object per line)
+    when the Content-Type is application/x-ndjson. NDJSON is parsed as it streams in.
+    Bodies over NOTES_BATCH_MAX_BYTES are rejected before they are read in full.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > NOTES_BATCH_MAX_BYTES:
+         raise HTTPException(status_code=413, detail=f"Batch body exceeds {NOTES_BATCH_MAX_BYTES} bytes")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/x-ndjson", "application/jsonl"):
+         body = bytearray()
+         async for chunk in request.stream():
+              body += chunk
+              if len(body) > NOTES_BATCH_MAX_BYTES:
+                   raise HTTPException(status_code=413, detail=f"Batch body exceeds {NOTES_BATCH_MAX_BYTES} bytes")
+         try:
+              items = json.loads(body)
+         except ValueError:
+              raise HTTPException(status_code=400, detail="Body must be a JSON array")
+         if not isinstance(items, list):
+              raise HTTPException(status_code=400, detail="Body must be a JSON array")
+         if len(items) > NOTES_BATCH_MAX_ITEMS:
+              raise HTTPException(status_code=413, detail=f"At most {NOTES_BATCH_MAX_ITEMS} notes per batch")
+         return items
+
+    items = []
+    buffer = b""
+    received = 0
+    async for chunk in request.stream():
+         received += len(chunk)
+         if received > NOTES_BATCH_MAX_BYTES:
+              raise HTTPException(status_code=413, detail=f"Batch body exceeds {NOTES_BATCH_MAX_BYTES} bytes")
+         buffer += chunk
+         *lines, buffer = buffer.split(b"\n")
+         for line in lines:
+              if line.strip():
+                   items.append(parse_ndjson_line(line))
+         if len(items) > NOTES_BATCH_MAX_ITEMS:
+              raise HTTPException(status_code=413, detail=f"At most {NOTES_BATCH_MAX_ITEMS} notes per batch")
+    if buffer.strip():
+         items.append(parse_ndjson_line(buffer))
+    if len(items) > NOTES_BATCH_MAX_ITEMS:
+         raise HTTPException(status_code=413, detail=f"At most {NOTES_BATCH_MAX_ITEMS} notes per batch")
+    return items
+
+def parse_ndjson_line(line: bytes) -> Any:
+    try:
+         return json.loads(line)
+    except ValueError as e:
+         # Reported per item, so one broken line does not reject the whole batch.
+         return e
+
+@app.post("/api/notes/batch", response_model=List[NoteBatchItemResult])
+async def create_notes_batch_endpoint(request: Request, current_vault: Vault = Depends(get_current_vault)):
+    items = await read_batch_items(request)
+    results: List[NoteBatchItemResult] = []
+    notes: List[Tuple[int, Note]] = []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+         try:
+              if isinstance(item, Exception):
+                   raise item
+              note_data = NoteCreate.model_validate(item)
+         except ValueError as e:
+              results.append(NoteBatchItemResult(index=index, status="invalid", error=str(e)))
+              continue
+         notes.append((index, Note(
+              id=uuid4(),
+              vault_id=current_vault.id,
+              external_id=note_data.external_id,
+              title=note_data.title,
+              content=note_data.content,
+              # Keep the batch order stable for listing by (created_at, id).
+              created_at=now + timedelta(microseconds=len(notes)),
+              updated_at=now,
+         )))
+
+    if notes:
+         inserted, stored = await db.create_notes_batch(current_vault.id, [note for _, note in notes])
+         for index, note in notes:
+              if note.id in inserted:
+                   delivery_logger.record("created", note.id, current_vault.id, external_id=note.external_id)
+                   results.append(NoteBatchItemResult(index=index, status="created", id=note.id, external_id=note.external_id))
+              else:
+                   results.append(NoteBatchItemResult(
+                        index=index, status="duplicate", id=stored.get(note.external_id), external_id=note.external_id
+                   ))
+    results.sort(key=lambda result: result.index)
+    return results
+
+@app.get("/api/notes", response_model=Union[List[NoteResponse], List[NoteSummaryResponse]])
+async def list_notes(
+    request: Request,
+    response: Response,
+    state: Optional[str] = None,
+    limit: int = 10,
+    offset: int = 0,
+    after: Optional[str] = None,
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    wait: int = Query(0, ge=0, le=NOTES_LONG_POLL_MAX_SECONDS),
+    client_id: Optional[str] = None,
+    current_vault: Vault = Depends(get_current_vault),
+):
+    client_heartbeats.record_poll(current_vault.id, client_id)
+    if after is not None and offset:
+         raise HTTPException(status_code=400, detail="after and offset cannot be combined")
+    after_key = decode_cursor(after) if after is not None else None
+    if_none_match = request.headers.get("if-none-match")
+    query = (state.upper() if state is not None else None, limit, offset, after, fields)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    # Subscribe before reading the version so a change in between is not missed.
+    async with vault_events.subscribe(current_vault.id) as queue:
+         while True:
+              # The version is read before the notes, so the ETag never claims more than the page shows.
+              etag = make_etag(await db.get_vault_version(current_vault.id), *query)
+              notes = None
+              if if_none_match != etag:
+                   notes = await fetch_notes(current_vault.id, state, limit, offset, after_key, fields == "summary")
+              remaining = deadline - loop.time()
+              if notes or remaining <= 0:
+                   break
+              try:
+                   if await asyncio.wait_for(queue.get(), timeout=remaining) is None:
+                        break
+              except asyncio.TimeoutError:
+                   break
+    if notes is None:
+         return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    headers = {"ETag": etag}
+    if limit > 0 and len(notes) == limit:
+         last = notes[-1]
+         if FAST_JSON_RESPONSES:
+              headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+         else:
+              headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    if FAST_JSON_RESPONSES:
+         return Response(content=encode_rows(notes), media_type="application/json", headers=headers)
+    response.headers.update(headers)
+    return notes
+
+@app.get("/api/notes/search", response_model=List[NoteSearchResponse])
+async def search_notes(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    state: Optional[NoteState] = None,
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    current_vault: Vault = Depends(get_current_vault),
+):
+    after_key = decode_search_cursor(after) if after is not None else None
+    results = await db.search_notes(current_vault.id, q, state.value if state else None, limit, after_key)
+    if len(results) == limit:
+         last = results[-1]
+         response.headers["X-Next-Cursor"] = encode_search_cursor(last.rank, last.created_at, last.id)
+    return results
+
+@app.get("/api/notes/stream")
+async def stream_notes(request: Request, client_id: Optional[str] = None, current_vault: Vault = Depends(get_current_vault)):
+    client_heartbeats.record_poll(current_vault.id, client_id)
+    async def event_stream():
+         async with vault_events.subscribe(current_vault.id) as queue:
+              yield ": connected\n\n"
+              while not await request.is_disconnected():
+                   try:
+                        event = await asyncio.wait_for(queue.get(), timeout=NOTES_STREAM_KEEPALIVE_SECONDS)
+                   except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                   if event is None:
+                        return
+                   yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+         event_stream(),
+         media_type="text/event-stream",
+         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/notes/claim-batch", response_model=List[NoteResponse])
+async def claim_notes_batch_endpoint(claim_data: ClaimBatchRequest, current_vault: Vault = Depends(get_current_vault)):
+    client_heartbeats.record_poll(current_vault.id, claim_data.client_id)
+    claimed_notes = await db.claim_notes_batch(current_vault.id, claim_data.client_id, claim_data.limit)
+    if claimed_notes:
+         client_heartbeats.record_claims(current_vault.id, claim_data.client_id, len(claimed_notes))
+    for note in claimed_notes:
+         delivery_logger.record("claimed", note.id, current_vault.id, claim_data.client_id)
+    return claimed_notes
+
+@app.post("/api/notes/confirm-batch", response_model=List[NoteResponse])
+async def confirm_notes_batch_endpoint(confirm_data: ConfirmBatchRequest, current_vault: Vault = Depends(get_current_vault)):
+    confirmed_notes = await db.confirm_notes_batch(current_vault.id, confirm_data.note_ids, confirm_data.client_id)
+    for note in confirmed_notes:
+         delivery_logger.record("delivered", note.id, current_vault.id, note.claim_owner)
+    return confirmed_notes
 
 @app.post("/api/notes/{note_id}/claim", response_model=NoteResponse)
 async def claim_note_endpoint(note_id: UUID, request: Request, current_vault: Vault = Depends(get_current_vault)):
@@ -193,25 +713,101 @@ async def claim_note_endpoint(note_id: UUID, request: Request, current_vault: Va
     client_id = data.get("client_id")
     if not client_id:
          raise HTTPException(status_code=400, detail="client_id required")
-    claimed_note = await db.claim_note(note_id, client_id)
+    claimed_note = await db.claim_note(note_id, current_vault.id, client_id)
     if not claimed_note:
          raise HTTPException(status_code=409, detail="Note already claimed or not in PENDING state")
+    delivery_logger.record("claimed", claimed_note.id, current_vault.id, client_id)
+    client_heartbeats.record_claims(current_vault.id, client_id)
     return claimed_note
 
+async def stream_note_json(note: dict, vault_id: UUID) -> AsyncIterator[bytes]:
+    """
+    Encode a note as NoteResponse JSON piece by piece, reading its content from the
+    database in chunks, so a large body is never held in memory as a whole.
+    """
+    meta = NoteResponse.model_validate({**note, "content": ""}).model_dump(mode="json")
+    del meta["content"]
+    yield (json.dumps(meta)[:-1] + ', "content": "').encode()
+    async for chunk in db.read_note_content(note, vault_id, NOTE_DOWNLOAD_CHUNK_SIZE):
+         yield json.dumps(chunk, ensure_ascii=False)[1:-1].encode()
+    yield b'"}'
+
 @app.get("/api/notes/{note_id}/download", response_model=NoteResponse)
 async def download_note_endpoint(note_id: UUID, current_vault: Vault = Depends(get_current_vault)):
-    note = await db.download_note(note_id)
-    if not note or str(note.vault_id) != str(current_vault.id):
+    note = await db.download_note(note_id, raw=True, vault_id=current_vault.id,
+                                  max_content_length=NOTE_DOWNLOAD_STREAM_THRESHOLD)
+    if not note or str(note["vault_id"]) != str(current_vault.id):
          raise HTTPException(status_code=404, detail="Note not found")
-    return note
+    delivery_logger.record("downloaded", note["id"], current_vault.id, note["claim_owner"])
+    if note["content"] is None:
+         return StreamingResponse(stream_note_json(note, current_vault.id), media_type="application/json")
+    if FAST_JSON_RESPONSES:
+         return Response(content=encode_row(note), media_type="application/json")
+    return Note(**note)
 
 @app.post("/api/notes/{note_id}/confirm", response_model=NoteResponse)
-async def confirm_note_endpoint(note_id: UUID, current_vault: Vault = Depends(get_current_vault)):
-    confirmed_note = await db.confirm_note(note_id)
+async def confirm_note_endpoint(note_id: UUID, confirm_data: ConfirmRequest,
+                                current_vault: Vault = Depends(get_current_vault)):
+    confirmed_note = await db.confirm_note(note_id, current_vault.id, confirm_data.client_id)
     if not confirmed_note:
-         raise HTTPException(status_code=409, detail="Note not in CLAIMED state or not found")
+         raise HTTPException(status_code=409, detail="Note not claimed by this client or not found")
+    delivery_logger.record("delivered", confirmed_note.id, current_vault.id, confirmed_note.claim_owner)
     return confirmed_note
 
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_internal_token)])
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health")
+async def health():
+    """
+    Liveness: the worker's event loop is responsive.
+    """
+    return {"status": "draining" if shutdown.draining else "ok"}
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: the worker is not shutting down, the pool answers and notifications are
+    being received. Reports the pool state either way.
+    """
+    checks = {
+         "accepting": shutdown.ready and not shutdown.draining,
+         "database": await db.ping(),
+         "event_listener": all(listener.connected for listener in [event_listener, *shard_event_listeners]),
+    }
+    body = {
+         "status": "ready" if all(checks.values()) else "not ready",
+         "checks": checks,
+         "pools": db.pool_stats(),
+         "in_flight": admission_control.in_flight,
+    }
+    return JSONResponse(body, status_code=200 if all(checks.values()) else 503)
+
+@app.get("/stats/cache", dependencies=[Depends(require_internal_token)])
+async def cache_stats():
+    return db.cache_stats()
+
+@app.get("/stats/hashing", dependencies=[Depends(require_internal_token)])
+async def hashing_stats():
+    return hashing_pool.stats()
+
+@app.get("/stats/delivery-log", dependencies=[Depends(require_internal_token)])
+async def delivery_log_stats():
+    return delivery_logger.stats()
+
+@app.get("/stats/note-stats-reconciliation", dependencies=[Depends(require_internal_token)])
+async def note_stats_reconciliation_stats():
+    return note_stats_reconciler.stats()
+
+@app.get("/stats/claim-reaper", dependencies=[Depends(require_internal_token)])
+async def claim_reaper_stats():
+    return claim_reaper.stats()
+
+@app.get("/stats/retention", dependencies=[Depends(require_internal_token)])
+async def retention_stats():
+    return retention_worker.stats()
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     file_path = os.path.join("static", "index.html")
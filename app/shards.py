@@ -0,0 +1,43 @@
+import hashlib
+from typing import Dict, Sequence
+from uuid import UUID
+
+# The database named by POSTGRES_DSN. It holds users, vaults, tokens and the
+# vault_shards directory for every vault, and the notes of vaults not placed elsewhere.
+MAIN_SHARD = "main"
+
+
+class VaultMovedError(Exception):
+    """
+    A note write reached a shard the vault is being moved away from. The write is
+    rolled back; the client should retry once the move has finished.
+    """
+
+    def __init__(self, vault_ids: Sequence[str]):
+        super().__init__(f"Vaults {', '.join(vault_ids)} are being moved to another shard")
+        self.vault_ids = list(vault_ids)
+
+
+def place_vault(vault_id: UUID, shards: Sequence[str]) -> str:
+    """
+    Shard for a new vault by rendezvous hashing: every shard scores the vault and the
+    highest score wins. Adding a shard only draws new vaults to it; placed vaults
+    stay where the directory says until they are moved.
+    """
+    return max(shards, key=lambda shard: hashlib.sha256(f"{shard}:{vault_id}".encode()).digest())
+
+
+def parse_shard_dsns(value: str) -> Dict[str, str]:
+    """
+    Parse whitespace-separated "name=dsn" pairs into a mapping of shard name to DSN.
+    Commas are not used as separators because multi-host DSNs contain them.
+    """
+    shards = {}
+    for item in value.split():
+        name, sep, dsn = item.partition("=")
+        if not sep or not name or not dsn:
+            raise ValueError(f"Invalid shard definition {item!r}, expected name=dsn")
+        if name == MAIN_SHARD:
+            raise ValueError(f"Shard name {MAIN_SHARD!r} is reserved for POSTGRES_DSN")
+        shards[name] = dsn
+    return shards
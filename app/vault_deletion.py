@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class VaultDeletionWorker:
+    """
+    Background task that removes the data of deleted vaults in batches of
+    `batch_size` rows, each in its own short transaction, pausing `batch_pause`
+    seconds in between so one large vault cannot monopolize the database. Runs when
+    woken by a deletion request and every `interval` seconds, which also picks up
+    deletions left unfinished by a restart or by another worker. A vault another
+    worker is already purging is skipped.
+    """
+
+    def __init__(self, db: Database, batch_size: int = 1000, batch_pause: float = 0.05, interval: float = 60.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+        self.rows_deleted_total = 0
+        self.vaults_deleted_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def wake(self):
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors_total += 1
+                logger.exception("Vault deletion run failed.")
+
+    async def run_once(self) -> int:
+        vaults = 0
+        for vault_id in await self.db.get_pending_vault_deletions():
+            await self.purge(vault_id)
+            vaults += 1
+        return vaults
+
+    async def purge(self, vault_id):
+        while True:
+            result = await self.db.purge_vault_batch(vault_id, self.batch_size)
+            if result is None:
+                # Another worker is purging this vault.
+                return
+            deleted, finished = result
+            self.batches_total += 1
+            self.rows_deleted_total += deleted
+            if finished:
+                self.vaults_deleted_total += 1
+                logger.info("Deleted vault %s.", vault_id)
+                return
+            await asyncio.sleep(self.batch_pause)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "rows_deleted_total": self.rows_deleted_total,
+            "vaults_deleted_total": self.vaults_deleted_total,
+            "batches_total": self.batches_total,
+            "errors_total": self.errors_total,
+        }
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of note list serialization: the default path (DB row -> Note ->
+response_model validation -> JSON) against the fast path in app/serialization.py.
+
+    JWT_SECRET=x python -m benchmarks.bench_serialization --notes 50 --content-size 4096
+"""
+import argparse
+import datetime
+import json
+import timeit
+import uuid
+from typing import List
+
+from asyncpg.pgproto import pgproto
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.models import Note
+from app.serialization import encode_rows, orjson
+from app.server import NoteResponse
+
+
+def make_rows(count: int, content_size: int) -> List[dict]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    vault_id = pgproto.UUID(str(uuid.uuid4()))
+    return [
+        {
+            "id": pgproto.UUID(str(uuid.uuid4())),
+            "vault_id": vault_id,
+            "external_id": f"ext_{i}",
+            "title": f"Note {i}",
+            "content": ("Lorem ipsum dolor sit amet. " * (content_size // 28 + 1))[:content_size],
+            "state": "PENDING",
+            "claim_owner": None,
+            "claim_timestamp": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(count)
+    ]
+
+
+response_adapter = TypeAdapter(List[NoteResponse])
+
+
+def default_path(rows: List[dict]) -> bytes:
+    # What Database + FastAPI do for response_model=List[NoteResponse].
+    notes = [Note(**dict(row)) for row in rows]
+    validated = response_adapter.validate_python([note.model_dump() for note in notes])
+    content = jsonable_encoder(response_adapter.dump_python(validated, mode="json"))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def fast_path(rows: List[dict]) -> bytes:
+    return encode_rows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=50)
+    parser.add_argument("--content-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.notes, args.content_size)
+    assert json.loads(default_path(rows)) == json.loads(fast_path(rows)), "Fast path output differs"
+
+    print(f"{args.notes} notes x {args.content_size} bytes, orjson={'yes' if orjson else 'no'}")
+    results = {}
+    for name, func in (("default", default_path), ("fast", fast_path)):
+        timer = timeit.Timer(lambda: func(rows))
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=args.repeat, number=number)) / number
+        results[name] = best
+        print(f"{name:>8}: {best * 1e6:10.1f} us/response  {1 / best:10.0f} responses/s")
+    print(f"speedup: {results['default'] / results['fast']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
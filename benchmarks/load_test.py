@@ -0,0 +1,240 @@
+"""
+Load test of the note delivery pipeline against a running server.
+
+M integrators create notes in V vaults while K plugin clients per vault race
+through list -> claim -> download -> confirm (or claim-batch -> confirm-batch
+with --mode batch). Reports ops/sec and p50/p95/p99 latency per endpoint and
+counts duplicate deliveries, which must stay at zero.
+
+    python -m benchmarks.load_test --base-url http://localhost:8000 --vaults 4 --integrators 8 --clients 3
+    python -m benchmarks.load_test --save-baseline      # record the current numbers
+    python -m benchmarks.load_test                      # fail if slower than the baseline
+
+Exit status is 1 on duplicate or lost deliveries, failed requests or regressions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Set
+
+import httpx
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str,
+                      expected=(200,), **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append(time.perf_counter() - started)
+        if response.status_code not in expected:
+            self.errors[f"{name} {response.status_code}"] += 1
+        return response
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def setup_vaults(client: httpx.AsyncClient, count: int) -> (dict, List[dict]):
+    username = f"load_{uuid.uuid4().hex[:8]}"
+    r = await client.post("/api/register", json={"username": username, "email": f"{username}@example.com", "password": "loadtest"})
+    r.raise_for_status()
+    r = await client.post("/api/login", data={"username": username, "password": "loadtest"})
+    r.raise_for_status()
+    jwt_headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    vaults = []
+    for i in range(count):
+        r = await client.post("/api/vaults", json={"name": f"Load vault {i}"}, headers=jwt_headers)
+        r.raise_for_status()
+        vaults.append(r.json())
+    return jwt_headers, vaults
+
+
+async def integrator(client: httpx.AsyncClient, recorder: Recorder, vault: dict, notes: int,
+                     content: str, created: Set[str]):
+    headers = {"Authorization": f"Bearer {vault['token']}"}
+    for i in range(notes):
+        r = await recorder.request(client, "create", "POST", "/api/notes", expected=(201,), headers=headers,
+                                   json={"external_id": uuid.uuid4().hex, "title": f"Load {i}", "content": content})
+        if r.status_code == 201:
+            created.add(r.json()["id"])
+
+
+async def plugin_client(client: httpx.AsyncClient, recorder: Recorder, vault: dict, client_id: str, mode: str,
+                        integrators_done: asyncio.Event, delivered: List[str], confirmed: Set[str]):
+    """
+    Every note handed out by a successful claim is appended to `delivered`, so a note
+    claimed by two clients shows up twice there.
+    """
+    headers = {"Authorization": f"Bearer {vault['token']}"}
+    while True:
+        if mode == "batch":
+            r = await recorder.request(client, "claim-batch", "POST", "/api/notes/claim-batch", headers=headers,
+                                       json={"client_id": client_id, "limit": 10})
+            claimed = r.json() if r.status_code == 200 else []
+            delivered.extend(note["id"] for note in claimed)
+            if claimed:
+                r = await recorder.request(client, "confirm-batch", "POST", "/api/notes/confirm-batch", headers=headers,
+                                           json={"note_ids": [note["id"] for note in claimed], "client_id": client_id})
+                if r.status_code == 200:
+                    confirmed.update(note["id"] for note in r.json())
+        else:
+            r = await recorder.request(client, "list", "GET", "/api/notes?state=PENDING&limit=10", headers=headers)
+            claimed = r.json() if r.status_code == 200 else []
+            for note in claimed:
+                r = await recorder.request(client, "claim", "POST", f"/api/notes/{note['id']}/claim", expected=(200, 409),
+                                           headers=headers, json={"client_id": client_id})
+                if r.status_code != 200:
+                    continue
+                delivered.append(note["id"])
+                await recorder.request(client, "download", "GET", f"/api/notes/{note['id']}/download", headers=headers)
+                r = await recorder.request(client, "confirm", "POST", f"/api/notes/{note['id']}/confirm", headers=headers,
+                                           json={"client_id": client_id})
+                if r.status_code == 200:
+                    confirmed.add(note["id"])
+        if not claimed:
+            if integrators_done.is_set():
+                return
+            await asyncio.sleep(0.05)
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        jwt_headers, vaults = await setup_vaults(client, args.vaults)
+        recorder = Recorder()
+        created: Set[str] = set()
+        delivered: List[str] = []
+        confirmed: Set[str] = set()
+        integrators_done = asyncio.Event()
+        content = "Lorem ipsum dolor sit amet. " * max(1, args.content_size // 28)
+
+        started = time.perf_counter()
+        clients = [
+            asyncio.create_task(plugin_client(client, recorder, vault, f"client_{v}_{k}", args.mode, integrators_done, delivered, confirmed))
+            for v, vault in enumerate(vaults) for k in range(args.clients)
+        ]
+        await asyncio.gather(*(
+            integrator(client, recorder, vaults[i % len(vaults)], args.notes, content, created)
+            for i in range(args.integrators)
+        ))
+        integrators_done.set()
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - started
+
+        for vault in vaults:
+            await client.delete(f"/api/vaults/{vault['id']}", headers=jwt_headers)
+
+    deliveries = Counter(delivered)
+    endpoints = {
+        name: {
+            "count": len(values),
+            "ops_per_sec": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+        for name, values in sorted(recorder.latencies.items())
+    }
+    return {
+        "mode": args.mode,
+        "elapsed_seconds": elapsed,
+        "notes_created": len(created),
+        "notes_delivered": len(confirmed),
+        "duplicate_deliveries": sum(count - 1 for count in deliveries.values() if count > 1),
+        "lost_notes": len(created - confirmed),
+        "errors": dict(recorder.errors),
+        "delivered_per_sec": len(confirmed) / elapsed,
+        "endpoints": endpoints,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f} ms > baseline {previous['p95_ms']:.1f} ms")
+    if result["delivered_per_sec"] < baseline.get("delivered_per_sec", 0) * (1 - tolerance):
+        regressions.append(
+            f"throughput {result['delivered_per_sec']:.1f} notes/s < baseline {baseline['delivered_per_sec']:.1f} notes/s"
+        )
+    return regressions
+
+
+def report(result: dict):
+    print(f"mode={result['mode']}  elapsed={result['elapsed_seconds']:.2f}s  "
+          f"created={result['notes_created']}  delivered={result['notes_delivered']}  "
+          f"({result['delivered_per_sec']:.1f} notes/s)")
+    print(f"{'endpoint':<15}{'count':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<15}{stats['count']:>8}{stats['ops_per_sec']:>10.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"duplicate deliveries: {result['duplicate_deliveries']}  lost notes: {result['lost_notes']}")
+    if result["errors"]:
+        print(f"errors: {result['errors']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--mode", choices=("single", "batch"), default="single")
+    parser.add_argument("--vaults", type=int, default=4)
+    parser.add_argument("--integrators", type=int, default=8, help="note producers, spread over the vaults")
+    parser.add_argument("--notes", type=int, default=100, help="notes created by each integrator")
+    parser.add_argument("--clients", type=int, default=3, help="plugin clients per vault")
+    parser.add_argument("--content-size", type=int, default=2048)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2)) if args.json else report(result)
+
+    failures = []
+    if result["duplicate_deliveries"]:
+        failures.append(f"{result['duplicate_deliveries']} notes were delivered more than once")
+    if result["lost_notes"]:
+        failures.append(f"{result['lost_notes']} notes were never confirmed")
+    if result["errors"]:
+        failures.append("some requests failed")
+
+    baselines: Dict[str, dict] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[args.mode] = result
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    elif args.mode in baselines:
+        failures.extend(compare(result, baselines[args.mode], args.tolerance))
+    else:
+        print(f"no {args.mode} baseline in {args.baseline}, skipping comparison")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,24 @@
+import importlib.util
+
+import uvicorn
+
+from settings import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_RELOAD, SHUTDOWN_GRACE_SECONDS
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("app.server:app", host="0.0.0.0", port=8000, reload=True)
+    if SERVER_RELOAD:
+        uvicorn.run("app.server:app", host=SERVER_HOST, port=SERVER_PORT, reload=True)
+    else:
+        uvicorn.run(
+            "app.server:app",
+            host=SERVER_HOST,
+            port=SERVER_PORT,
+            workers=SERVER_WORKERS,
+            loop="uvloop" if installed("uvloop") else "asyncio",
+            http="httptools" if installed("httptools") else "h11",
+            timeout_graceful_shutdown=SHUTDOWN_GRACE_SECONDS,
+        )
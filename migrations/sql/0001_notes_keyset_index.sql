@@ -0,0 +1,7 @@
+-- Keyset pagination over (created_at, id), with and without a state filter.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_vault_state_created ON notes(vault_id, state, created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_vault_created ON notes(vault_id, created_at, id);
+
+-- idx_notes_vault_state is now redundant, but 0000 creates it again on every boot,
+-- with a plain CREATE INDEX that blocks writes to notes while it builds. It is
+-- therefore left in place rather than dropped here and rebuilt at the next start.
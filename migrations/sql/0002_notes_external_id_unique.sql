@@ -0,0 +1,15 @@
+-- external_id is the integrator's idempotency key and must be unique per vault.
+-- Notes that were duplicated before this migration keep their content, but only
+-- the oldest one keeps the key.
+UPDATE notes SET external_id = NULL
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY vault_id, external_id ORDER BY created_at, id) AS rn
+        FROM notes
+        WHERE external_id IS NOT NULL
+    ) ranked
+    WHERE rn > 1
+);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_vault_external_id
+    ON notes(vault_id, external_id) WHERE external_id IS NOT NULL;
@@ -0,0 +1,26 @@
+-- Delivered notes are moved out of the hot notes table by the retention worker.
+CREATE TABLE IF NOT EXISTS notes_archive (
+  id UUID PRIMARY KEY,
+  vault_id UUID NOT NULL REFERENCES vaults(id) ON DELETE CASCADE,
+  external_id TEXT,
+  title TEXT,
+  content TEXT NOT NULL,
+  state note_state NOT NULL,
+  claim_owner TEXT,
+  claim_timestamp TIMESTAMP WITH TIME ZONE,
+  created_at TIMESTAMP WITH TIME ZONE,
+  updated_at TIMESTAMP WITH TIME ZONE,
+  archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notes_archive_vault_created ON notes_archive(vault_id, created_at, id);
+
+-- Lets the retention worker find old delivered notes without touching PENDING/CLAIMED rows.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_delivered_updated ON notes(updated_at) WHERE state = 'DELIVERED';
+
+-- Delivery logs must survive archival of their note, so they reference the vault
+-- instead of the note row.
+ALTER TABLE delivery_logs ADD COLUMN IF NOT EXISTS vault_id UUID REFERENCES vaults(id) ON DELETE CASCADE;
+UPDATE delivery_logs l SET vault_id = n.vault_id FROM notes n WHERE l.note_id = n.id AND l.vault_id IS NULL;
+ALTER TABLE delivery_logs DROP CONSTRAINT IF EXISTS delivery_logs_note_id_fkey;
+CREATE INDEX IF NOT EXISTS idx_delivery_logs_note ON delivery_logs(note_id);
@@ -0,0 +1,6 @@
+-- Compress large note bodies with lz4 instead of the default pglz. Values above the
+-- TOAST threshold (about 2 kB) are compressed transparently, so queries and full
+-- text indexes keep working on plain text. Existing rows keep their compression
+-- until they are rewritten.
+ALTER TABLE notes ALTER COLUMN content SET COMPRESSION lz4;
+ALTER TABLE notes_archive ALTER COLUMN content SET COMPRESSION lz4;
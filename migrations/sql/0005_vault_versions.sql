@@ -0,0 +1,6 @@
+-- Monotonic per-vault change counter, bumped whenever a note of the vault is
+-- created, claimed, delivered or archived. Used for ETags on note listings.
+CREATE TABLE IF NOT EXISTS vault_versions (
+  vault_id UUID PRIMARY KEY REFERENCES vaults(id) ON DELETE CASCADE,
+  version BIGINT NOT NULL DEFAULT 0
+);
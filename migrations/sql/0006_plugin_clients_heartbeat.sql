@@ -0,0 +1,20 @@
+-- One row per (vault, client_id), upserted in bulk from the in-process heartbeat buffer.
+DELETE FROM plugin_clients
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY vault_id, client_identifier ORDER BY last_seen DESC, id) AS rn
+        FROM plugin_clients
+    ) ranked
+    WHERE rn > 1
+);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_plugin_clients_vault_client
+    ON plugin_clients(vault_id, client_identifier);
+
+-- Poll counts of the current and the previous fixed window, for the poll rate estimate.
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS first_seen TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS poll_count BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS claim_count BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS window_start TIMESTAMP WITH TIME ZONE;
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS window_polls BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE plugin_clients ADD COLUMN IF NOT EXISTS previous_window_polls BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,8 @@
+-- Shared token buckets for RATE_LIMIT_BACKEND=postgres. Losing them on a crash only
+-- resets the limits, so the table is not WAL-logged.
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+  key TEXT PRIMARY KEY,
+  tokens DOUBLE PRECISION NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL,
+  taken BOOLEAN NOT NULL DEFAULT true
+);
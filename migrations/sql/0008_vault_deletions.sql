@@ -0,0 +1,17 @@
+-- Vaults are deleted in two steps: the row is marked (which revokes the token at
+-- once) and a background job removes its notes and logs in small batches.
+ALTER TABLE vaults ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+
+-- Progress of each deletion; kept after the vault row itself is gone.
+CREATE TABLE IF NOT EXISTS vault_deletions (
+  vault_id UUID PRIMARY KEY,
+  user_id UUID NOT NULL,
+  requested_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  rows_deleted BIGINT NOT NULL DEFAULT 0,
+  finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_vault_deletions_pending ON vault_deletions(requested_at) WHERE finished_at IS NULL;
+
+-- Batched deletes (and the FK check of the final vault delete) look delivery logs up by vault.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_delivery_logs_vault ON delivery_logs(vault_id);
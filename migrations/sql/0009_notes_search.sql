@@ -0,0 +1,12 @@
+-- Full-text search over title and content. The 'simple' configuration does no
+-- stemming, so notes in any language are matched word for word. Only the first
+-- 256k characters of content are indexed, which keeps every tsvector well under
+-- its 1 MB limit. Adding the column rewrites the notes table once.
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', left(content, 262144)), 'B')
+) STORED;
+
+-- btree_gin lets one GIN index cover both the vault filter and the text match.
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_vault_search ON notes USING GIN (vault_id, search_vector);
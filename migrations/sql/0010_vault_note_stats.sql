@@ -0,0 +1,31 @@
+-- Number of notes of each vault per state, kept up to date by the statements that
+-- create, claim, deliver and archive notes, so backlog sizes are read without
+-- counting the notes table. A background job recounts vaults and repairs drift.
+CREATE TABLE IF NOT EXISTS vault_note_stats (
+  vault_id UUID PRIMARY KEY REFERENCES vaults(id) ON DELETE CASCADE,
+  pending BIGINT NOT NULL DEFAULT 0,
+  claimed BIGINT NOT NULL DEFAULT 0,
+  delivered BIGINT NOT NULL DEFAULT 0,
+  archived BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  reconciled_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Initial counts. Only runs while the table is empty, so later boots skip the scan.
+INSERT INTO vault_note_stats (vault_id, pending, claimed, delivered, archived, reconciled_at)
+SELECT v.id,
+       coalesce(n.pending, 0), coalesce(n.claimed, 0), coalesce(n.delivered, 0), coalesce(a.archived, 0),
+       CURRENT_TIMESTAMP
+FROM vaults v
+LEFT JOIN (
+  SELECT vault_id,
+         count(*) FILTER (WHERE state = 'PENDING') AS pending,
+         count(*) FILTER (WHERE state = 'CLAIMED') AS claimed,
+         count(*) FILTER (WHERE state = 'DELIVERED') AS delivered
+  FROM notes GROUP BY vault_id
+) n ON n.vault_id = v.id
+LEFT JOIN (
+  SELECT vault_id, count(*) AS archived FROM notes_archive GROUP BY vault_id
+) a ON a.vault_id = v.id
+WHERE v.deleted_at IS NULL AND NOT EXISTS (SELECT 1 FROM vault_note_stats)
+ON CONFLICT (vault_id) DO NOTHING;
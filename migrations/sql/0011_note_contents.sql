@@ -0,0 +1,33 @@
+-- Large note bodies are stored once per distinct content, keyed by their sha256, and
+-- referenced from notes and notes_archive by content_hash. refcount is the number of
+-- note rows pointing at the body; a body is deleted when it drops to zero. Small
+-- bodies, and rows written before this migration, keep their text in content.
+CREATE TABLE IF NOT EXISTS note_contents (
+  hash BYTEA PRIMARY KEY,
+  content TEXT COMPRESSION lz4 NOT NULL,
+  size BIGINT NOT NULL,
+  refcount BIGINT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+ALTER TABLE notes ALTER COLUMN content DROP NOT NULL;
+ALTER TABLE notes_archive ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+ALTER TABLE notes_archive ALTER COLUMN content DROP NOT NULL;
+
+-- Body of a note row, whichever way it is stored.
+CREATE OR REPLACE FUNCTION note_body(content TEXT, content_hash BYTEA) RETURNS TEXT
+LANGUAGE sql STABLE AS $$
+  SELECT coalesce($1, (SELECT c.content FROM note_contents c WHERE c.hash = $2))
+$$;
+
+-- search_vector can no longer be generated from notes.content, which is NULL for
+-- deduplicated bodies. It becomes a plain column that inserts fill with this function;
+-- existing values are kept.
+CREATE OR REPLACE FUNCTION note_search_vector(title TEXT, content TEXT) RETURNS tsvector
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT setweight(to_tsvector('simple', coalesce($1, '')), 'A') ||
+         setweight(to_tsvector('simple', left(coalesce($2, ''), 262144)), 'B')
+$$;
+
+ALTER TABLE notes ALTER COLUMN search_vector DROP EXPRESSION IF EXISTS;
@@ -0,0 +1,15 @@
+-- Directory of vaults whose notes live on another Postgres instance (shard) than
+-- this main database. Users, vaults and tokens stay here for every vault; vaults
+-- without a row keep their data here too. moving_to is set while a vault is copied
+-- to another shard by `python -m app.rebalance`.
+CREATE TABLE IF NOT EXISTS vault_shards (
+  vault_id UUID PRIMARY KEY REFERENCES vaults(id) ON DELETE CASCADE,
+  shard TEXT NOT NULL,
+  moving_to TEXT,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Set on the shard a vault is moved away from. Note writes that still reach that
+-- shard fail on their version bump instead of being lost; the row is kept as a
+-- tombstone once the vault's data there is removed.
+ALTER TABLE vault_versions ADD COLUMN IF NOT EXISTS moved_to TEXT;
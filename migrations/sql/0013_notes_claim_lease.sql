@@ -0,0 +1,3 @@
+-- Lets the claim reaper find claims whose lease expired without touching the rest
+-- of the notes table. Only CLAIMED rows, a small share of it, are indexed.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_claimed_timestamp ON notes(claim_timestamp) WHERE state = 'CLAIMED';
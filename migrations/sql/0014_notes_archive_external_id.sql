@@ -0,0 +1,5 @@
+-- external_id stays an idempotency key after the note is archived: note creation
+-- looks it up in notes_archive too. Not unique, since earlier releases could archive
+-- a note and then accept its external_id again.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_archive_vault_external_id
+    ON notes_archive(vault_id, external_id) WHERE external_id IS NOT NULL;
@@ -1,16 +1,151 @@
 import os
 
-POSTGRES_HOST = 'postgres'
-POSTGRES_PORT = 5432
-POSTGRES_USER = 'postgres'
-POSTGRES_PASSWORD = 'password'
-POSTGRES_DATABASE = 'obsidianecho'
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "postgres")
+POSTGRES_PORT = int(os.environ.get("POSTGRES_PORT", 5432))
+POSTGRES_USER = os.environ.get("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD", "password")
+POSTGRES_DATABASE = os.environ.get("POSTGRES_DATABASE", "obsidianecho")
+# Optional read replica for note listings, downloads and vault listings.
+POSTGRES_REPLICA_DSN = os.environ.get("POSTGRES_REPLICA_DSN") or None
+# Reads within this many seconds of the caller's own vault changes stay on the primary.
+POSTGRES_REPLICA_LAG_WINDOW_SECONDS = float(os.environ.get("POSTGRES_REPLICA_LAG_WINDOW_SECONDS", 5))
 
 def get_postgres_dsn():
-    return f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}'
+    return os.environ.get("POSTGRES_DSN") or \
+        f'postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DATABASE}'
+
+# LISTEN needs a session of its own, so behind PgBouncer in transaction mode point this at Postgres directly.
+def get_listen_dsn():
+    return os.environ.get("POSTGRES_LISTEN_DSN") or get_postgres_dsn()
+
+# Extra Postgres instances holding the notes of some vaults, as whitespace-separated
+# "name=dsn" pairs. The POSTGRES_DSN database is the shard named "main" and keeps users,
+# vaults and the directory of which shard each vault lives on.
+POSTGRES_SHARDS = os.environ.get("POSTGRES_SHARDS", "")
+# Comma-separated shards new vaults are placed on; empty places them on all shards.
+SHARD_PLACEMENT = [name.strip() for name in os.environ.get("SHARD_PLACEMENT", "").split(",") if name.strip()]
+# Writes to a vault that is being moved between shards get 503 with this Retry-After.
+SHARD_MOVE_RETRY_AFTER_SECONDS = 1
+
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 10))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_INACTIVE_LIFETIME_SECONDS = float(os.environ.get("DB_POOL_MAX_INACTIVE_LIFETIME_SECONDS", 300))
+# 0 disables the timeout.
+DB_COMMAND_TIMEOUT_SECONDS = float(os.environ.get("DB_COMMAND_TIMEOUT_SECONDS", 60))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+# PgBouncer in transaction mode may run each statement on a different server connection,
+# so prepared statements must not be cached.
+DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"
+
+def get_pool_options():
+    return {
+        "min_size": min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+        "max_size": DB_POOL_MAX_SIZE,
+        "max_inactive_connection_lifetime": DB_POOL_MAX_INACTIVE_LIFETIME_SECONDS,
+        "command_timeout": DB_COMMAND_TIMEOUT_SECONDS or None,
+        "statement_cache_size": 0 if DB_PGBOUNCER else DB_STATEMENT_CACHE_SIZE,
+    }
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+# Worker processes, each with its own connection pool of up to DB_POOL_MAX_SIZE connections.
+# The default stops at 4, so 4 pools and their listeners fit in a stock max_connections=100.
+SERVER_WORKERS = int(os.environ.get("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4)))
+# Development mode: a single process restarted on code changes.
+SERVER_RELOAD = os.environ.get("SERVER_RELOAD", "false").lower() == "true"
+# How long a stopping worker waits for open requests before cancelling them.
+SHUTDOWN_GRACE_SECONDS = int(os.environ.get("SHUTDOWN_GRACE_SECONDS", 30))
+
+NOTES_LONG_POLL_MAX_SECONDS = 60
+NOTES_STREAM_KEEPALIVE_SECONDS = 15
+NOTES_BATCH_MAX_ITEMS = 1000
+# Batch bodies above this size are rejected with 413 before any of them is parsed.
+NOTES_BATCH_MAX_BYTES = 16 * 1024 * 1024
+
+# Gzip request bodies are inflated up to this size; responses are compressed above the minimum.
+REQUEST_MAX_DECOMPRESSED_SIZE = 32 * 1024 * 1024
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+# Encode note listings and downloads straight from DB rows (with orjson when installed),
+# skipping Pydantic validation of the response.
+FAST_JSON_RESPONSES = os.environ.get("FAST_JSON_RESPONSES", "false").lower() == "true"
+# Downloads with content above the threshold are streamed in chunks.
+NOTE_DOWNLOAD_STREAM_THRESHOLD = 256 * 1024
+NOTE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Note bodies of at least this many bytes are stored once per distinct content (by sha256)
+# and shared between notes; smaller ones stay in the note row. Downloads keep recently
+# read bodies in a per-worker LRU cache bounded by their total length in characters.
+NOTE_CONTENT_DEDUP_MIN_SIZE = int(os.environ.get("NOTE_CONTENT_DEDUP_MIN_SIZE", 2048))
+NOTE_CONTENT_CACHE_SIZE = int(os.environ.get("NOTE_CONTENT_CACHE_SIZE", 32 * 1024 * 1024))
+NOTE_CONTENT_CACHE_MAX_ITEM_SIZE = 1024 * 1024
+
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL_SECONDS = 60
+AUTH_NEGATIVE_CACHE_TTL_SECONDS = 5
+
+# DELIVERED notes older than this are moved to notes_archive by a background task.
+RETENTION_ENABLED = os.environ.get("RETENTION_ENABLED", "true").lower() == "true"
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 30))
+RETENTION_BATCH_SIZE = 500
+RETENTION_INTERVAL_SECONDS = 300
+RETENTION_BATCH_PAUSE_SECONDS = 0.1
+
+# CLAIMED notes not confirmed within the lease go back to PENDING, so another client
+# can claim them after a plugin crashed. The reaper runs on one worker at a time.
+CLAIM_LEASE_SECONDS = int(os.environ.get("CLAIM_LEASE_SECONDS", 600))
+CLAIM_REAPER_ENABLED = os.environ.get("CLAIM_REAPER_ENABLED", "true").lower() == "true"
+CLAIM_REAPER_INTERVAL_SECONDS = 30
+CLAIM_REAPER_BATCH_SIZE = 500
+CLAIM_REAPER_BATCH_PAUSE_SECONDS = 0.05
+
+# Data of deleted vaults is removed in the background in batches of this many rows.
+VAULT_DELETION_BATCH_SIZE = 1000
+VAULT_DELETION_BATCH_PAUSE_SECONDS = 0.05
+VAULT_DELETION_INTERVAL_SECONDS = 60
+
+# Per-vault note counts are maintained on every write; this job recounts all vaults
+# periodically and repairs counters that drifted.
+NOTE_STATS_RECONCILE_ENABLED = os.environ.get("NOTE_STATS_RECONCILE_ENABLED", "true").lower() == "true"
+NOTE_STATS_RECONCILE_INTERVAL_SECONDS = int(os.environ.get("NOTE_STATS_RECONCILE_INTERVAL_SECONDS", 3600))
+NOTE_STATS_RECONCILE_BATCH_SIZE = 100
+NOTE_STATS_RECONCILE_PAUSE_SECONDS = 0.05
+
+# Audit events of note endpoints are buffered in memory and written to delivery_logs
+# in batches. Events arriving while DELIVERY_LOG_MAX_BUFFERED are waiting are dropped.
+DELIVERY_LOG_ENABLED = os.environ.get("DELIVERY_LOG_ENABLED", "true").lower() == "true"
+DELIVERY_LOG_MAX_BUFFERED = int(os.environ.get("DELIVERY_LOG_MAX_BUFFERED", 10000))
+DELIVERY_LOG_BATCH_SIZE = 500
+DELIVERY_LOG_FLUSH_INTERVAL_SECONDS = 1.0
+
+# Plugin client heartbeats (client_id on polls and claims) are written to plugin_clients
+# once per interval. Clients seen within CLIENT_ACTIVE_SECONDS are listed as active.
+CLIENT_HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get("CLIENT_HEARTBEAT_INTERVAL_SECONDS", 10))
+CLIENT_HEARTBEAT_MAX_CLIENTS = 100000
+CLIENT_ACTIVE_SECONDS = 300
+
+# Token bucket limits per vault token and per user, kept in process ("memory"),
+# shared by all workers through Postgres ("postgres"), or turned "off".
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+VAULT_RATE_LIMIT_PER_SECOND = float(os.environ.get("VAULT_RATE_LIMIT_PER_SECOND", 50))
+VAULT_RATE_LIMIT_BURST = float(os.environ.get("VAULT_RATE_LIMIT_BURST", 200))
+USER_RATE_LIMIT_PER_SECOND = float(os.environ.get("USER_RATE_LIMIT_PER_SECOND", 10))
+USER_RATE_LIMIT_BURST = float(os.environ.get("USER_RATE_LIMIT_BURST", 50))
+RATE_LIMIT_MAX_KEYS = 100000
+# API requests handled at once per worker before new ones get 503; 0 disables the limit.
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get("MAX_IN_FLIGHT_REQUESTS", 200))
+ADMISSION_RETRY_AFTER_SECONDS = 1
+
+# bcrypt runs on a "process" (default) or "thread" pool outside the event loop.
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "process")
+# Per server worker; by default the CPUs are split between the server workers' pools.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 1) // SERVER_WORKERS)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 64))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 1
 
 JWT_EXPIRE_MINUTES = 24 * 60
 JWT_ALGORITHM = "HS256"
 JWT_SECRET = os.environ.get("JWT_SECRET")
 if not JWT_SECRET:
     raise ValueError("Environment variable JWT_SECRET is not set")
+# Bearer token for /metrics and /stats/*; while unset those endpoints refuse every request.
+INTERNAL_API_TOKEN = os.environ.get("INTERNAL_API_TOKEN") or None